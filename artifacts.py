@@ -0,0 +1,120 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+from dataset_cache import read_frame, replace_file, write_frame
+
+# Dashboard-ready artifacts written by precompute.py. Each run writes a new <version> directory and
+# then swaps current.json to point at it, so readers never see a half-written set
+ARTIFACT_DIR = os.environ.get("IHI_ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "artifacts"))
+CURRENT_FILE = "current.json"
+
+
+def read_current():
+    try:
+        with open(os.path.join(ARTIFACT_DIR, CURRENT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_version():
+    current = read_current()
+    return current["version"] if current else None
+
+
+def read_manifest(version):
+    with open(os.path.join(ARTIFACT_DIR, version, "manifest.json")) as f:
+        return json.load(f)
+
+
+def artifact_path(group, name, extension):
+    version = current_version()
+    if version is None:
+        return None
+    path = os.path.join(ARTIFACT_DIR, version, group, f"{name}.{extension}")
+    return path if os.path.exists(path) else None
+
+
+def publish(build_dir, version, manifest):
+    # The only step readers can observe: the complete directory is renamed into place and the
+    # pointer is replaced atomically
+    with open(os.path.join(build_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(build_dir, os.path.join(ARTIFACT_DIR, version))
+
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump({"version": version}, f)
+
+    replace_file(os.path.join(ARTIFACT_DIR, CURRENT_FILE), write)
+
+
+def write_table(directory, name, df):
+    write_frame(df, os.path.join(directory, f"{name}.feather"))
+
+
+def write_json(directory, name, value):
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        json.dump(value, f, separators=(",", ":"))
+
+
+def write_pickle(directory, name, value):
+    with open(os.path.join(directory, f"{name}.pkl"), "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_lookup(directory, name, lookup):
+    # The tensor values go to their own .npy so they can be memory-mapped; the rest is pickled
+    tensor = dict(lookup["tensor"])
+    np.save(os.path.join(directory, f"{name}_values.npy"), tensor.pop("values"))
+    write_pickle(directory, name, dict(lookup, tensor=tensor))
+
+
+def write_cube(directory, name, cube):
+    cube = dict(cube)
+    np.save(os.path.join(directory, f"{name}_values.npy"), cube.pop("values"))
+    write_pickle(directory, name, cube)
+
+
+# Loaders return None when no artifact has been published so callers can fall back to building it
+
+def load_table(group, name):
+    path = artifact_path(group, name, "feather")
+    return read_frame(path) if path else None
+
+
+def load_json(group, name):
+    path = artifact_path(group, name, "json")
+    if path is None:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_pickle(group, name):
+    path = artifact_path(group, name, "pkl")
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_lookup(group, name):
+    lookup = load_pickle(group, name)
+    values_path = artifact_path(group, f"{name}_values", "npy")
+    if lookup is None or values_path is None:
+        return None
+    lookup["tensor"]["values"] = np.load(values_path, mmap_mode="r")
+    return lookup
+
+
+def load_cube(group, name):
+    cube = load_pickle(group, name)
+    values_path = artifact_path(group, f"{name}_values", "npy")
+    if cube is None or values_path is None:
+        return None
+    cube["values"] = np.load(values_path, mmap_mode="r")
+    return cube
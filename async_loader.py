@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import carry_trace, rows_of, span
+
+# Seconds the dashboards wait for all their data before reporting what is still missing
+LOAD_TIMEOUT = float(os.environ.get("IHI_LOAD_TIMEOUT", 300))
+
+
+class LoadTimeout(TimeoutError):
+    pass
+
+
+async def iter_loads(loads, timeout=LOAD_TIMEOUT, thread_setup=None):
+    # Starts every blocking load at once in its own worker thread and yields
+    # (name, value, error, seconds) in the order they finish. Loads still running at the deadline
+    # are reported with a LoadTimeout; their threads keep running and fill the caches for the next run
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max(len(loads), 1), thread_name_prefix="load")
+
+    def run(name, load):
+        if thread_setup is not None:
+            thread_setup()
+        with span("load", load=name) as current:
+            value = load()
+            current.set(rows_out=rows_of(value))
+        return value
+
+    # Spans recorded by the loads belong to the caller's trace
+    run = carry_trace(run)
+    start = time.perf_counter()
+    names = {loop.run_in_executor(executor, run, name, load): name for name, load in loads.items()}
+    pending = set(names)
+    try:
+        while pending:
+            remaining = timeout - (time.perf_counter() - start)
+            done, pending = await asyncio.wait(pending, timeout=max(remaining, 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            elapsed = time.perf_counter() - start
+            if not done:
+                for future in pending:
+                    yield names[future], None, LoadTimeout(f"{names[future]} did not finish within {timeout:.0f}s"), elapsed
+                return
+            for future in done:
+                error = future.exception()
+                yield names[future], None if error else future.result(), error, elapsed
+    finally:
+        executor.shutdown(wait=False)
+
+
+def run_loads(loads, on_result, timeout=LOAD_TIMEOUT, thread_setup=None):
+    # Synchronous entry point for Streamlit scripts: on_result(name, value, error, seconds) runs in
+    # the calling thread as each load finishes, so it can fill in placeholders progressively
+    async def consume():
+        async for result in iter_loads(loads, timeout, thread_setup):
+            on_result(*result)
+
+    asyncio.run(consume())
+
+
+def load_progressively(loads, sections, render, report=None, timeout=LOAD_TIMEOUT, thread_setup=None):
+    # sections maps each page section to the loads it needs. render(section, loaded) runs in the
+    # calling thread as soon as all of them have arrived, in sections order;
+    # report(name, error, seconds, done, total) runs after every load. Returns the failed loads and,
+    # for each section that could not be drawn, the loads it was missing
+    loaded, failed, rendered = {}, {}, set()
+
+    def on_result(name, value, error, seconds):
+        if error is None:
+            loaded[name] = value
+        else:
+            failed[name] = error
+        if report is not None:
+            report(name, error, seconds, len(loaded) + len(failed), len(loads))
+        for section, needs in sections.items():
+            if section not in rendered and all(need in loaded for need in needs):
+                rendered.add(section)
+                # Includes building the section's figures and Streamlit serializing them
+                with span("render", section=section):
+                    render(section, loaded)
+
+    run_loads(loads, on_result, timeout, thread_setup)
+    blocked = {section: [need for need in needs if need in failed]
+               for section, needs in sections.items() if section not in rendered}
+    return failed, blocked
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import cms_api
+import drugs_b_data_retrieval
+import drugs_d_data_retrieval
+import geo_data_retrieval
+from cms_stub_server import start_server
+from drug_search import build_search_index, search_index
+from geo_cube import build_geo_cube, map_slice
+from geo_views import create_cost_breakdown_chart, create_map_chart, create_multi_year_cost_chart
+from geometry import DATA_DIR, get_us_county_geojson, get_us_state_geojson
+
+# Times and memory-profiles the fetch -> process -> derive -> view path against a local stub of the
+# CMS API serving synthetic (or recorded) datasets at several scales:
+#   python benchmark.py --scales 1 10 100 --output bench.json
+#   python benchmark.py --compare bench.json        # exits 1 on a regression
+#   python benchmark.py --imports                   # exits 1 when a headless module imports too slowly
+# Recorded fixtures (<dataset_id>.json files of CMS records) are scaled by replicating their rows
+
+MODULES = {
+    "geo": geo_data_retrieval,
+    "drugs_b": drugs_b_data_retrieval,
+    "drugs_d": drugs_d_data_retrieval,
+}
+# Entities per dataset at scale 1: counties, Part B drugs and Part D drugs
+BASE_COUNTIES = 150
+BASE_B_DRUGS = 800
+BASE_D_DRUGS = 1500
+GEO_YEARS = [str(year) for year in range(2014, 2023)]
+AGE_LEVELS = ["All", "<65", "65-74", "75-84", "85+"]
+SEARCH_QUERIES = ["brand1", "generic42", "brnad 7", "gen"]
+# A stage regresses when its median time grows by more than this factor and MIN_DELTA seconds
+REGRESSION_THRESHOLD = 1.25
+MIN_DELTA = 0.005
+# Modules batch jobs and worker processes import: each must load within IMPORT_ALLOWANCE seconds of
+# pandas itself and without pulling in any of the UI or network packages
+HEADLESS_MODULES = ["cms_api", "schema", "dataset_cache", "geo_data_retrieval", "drugs_b_data_retrieval",
+                    "drugs_d_data_retrieval", "artifacts", "precompute", "report_export"]
+UI_PACKAGES = ["streamlit", "plotly", "requests"]
+IMPORT_ALLOWANCE = 0.25
+
+
+def random_value(column, rng):
+    if column.sentinel is not None and rng.random() < 0.03:
+        return column.sentinel
+    if rng.random() < 0.02:
+        return ""
+    if np.dtype(column.dtype).kind in "iu":
+        return str(rng.randint(0, 1 if column.dtype == "int8" else 100000))
+    return f"{rng.uniform(0, 1000):.4f}"
+
+
+def numeric_values(schema, rng):
+    return {column.source: random_value(column, rng) for column in schema if column.dtype not in ("str", "category")}
+
+
+def synthetic_geo(scale, rng):
+    with open(os.path.join(DATA_DIR, "us_states.geojson")) as f:
+        states = [(feature["properties"]["STUSPS"], feature["properties"]["STATEFP"]) for feature in json.load(f)["features"]]
+    with open(os.path.join(DATA_DIR, "us_counties.geojson")) as f:
+        county_codes = [feature["properties"]["GEOID"] for feature in json.load(f)["features"]]
+    # Real FIPS codes first so the county map has shapes to draw, then made-up ones
+    county_count = BASE_COUNTIES * scale
+    counties = [(f"County {i}", county_codes[i] if i < len(county_codes) else f"9{i:06d}") for i in range(county_count)]
+    geographies = ([("National", "National", "")] + [("State", desc, code) for desc, code in states]
+                   + [("County", desc, code) for desc, code in counties])
+    schema = geo_data_retrieval.PROCESS_SCHEMA
+    return [{"YEAR": year, "BENE_GEO_LVL": level, "BENE_GEO_DESC": desc, "BENE_GEO_CD": code, "BENE_AGE_LVL": age,
+             **numeric_values(schema[5:], rng)}
+            for year in GEO_YEARS for level, desc, code in geographies for age in AGE_LEVELS]
+
+
+def synthetic_drugs_b(scale, rng):
+    return [{"HCPCS_Cd": f"J{i:05d}", "HCPCS_Desc": f"Description {i}", "Brnd_Name": f"Brand{i}",
+             "Gnrc_Name": f"generic{i % 500}", **numeric_values(drugs_b_data_retrieval.PROCESS_SCHEMA, rng)}
+            for i in range(BASE_B_DRUGS * scale)]
+
+
+def synthetic_drugs_d(scale, rng):
+    return [{"Brnd_Name": f"Brand{i}", "Gnrc_Name": f"generic{i % 700}", "Tot_Mftr": "2", "Mftr_Name": manufacturer,
+             **numeric_values(drugs_d_data_retrieval.PROCESS_SCHEMA, rng)}
+            for i in range(BASE_D_DRUGS * scale) for manufacturer in ("Overall", "Maker A", "Maker B")]
+
+
+SYNTHETIC = {"geo": synthetic_geo, "drugs_b": synthetic_drugs_b, "drugs_d": synthetic_drugs_d}
+
+
+def replicate(records, schema, scale):
+    # Copies of a recorded dataset with their identifying text columns suffixed so they stay distinct
+    keys = [column.source for column in schema if column.dtype == "str"]
+    scaled = list(records)
+    for copy in range(1, scale):
+        scaled.extend({**record, **{key: f"{record.get(key, '')}-{copy}" for key in keys}} for record in records)
+    return scaled
+
+
+def write_fixtures(fixture_dir, scale, recorded_dir=None, seed=0):
+    rows = {}
+    for name, module in MODULES.items():
+        if recorded_dir:
+            with open(os.path.join(recorded_dir, f"{module.DATASET_ID}.json")) as f:
+                records = replicate(json.load(f), module.PROCESS_SCHEMA, scale)
+        else:
+            records = SYNTHETIC[name](scale, random.Random(seed))
+        with open(os.path.join(fixture_dir, f"{module.DATASET_ID}.json"), "w") as f:
+            json.dump(records, f)
+        rows[name] = len(records)
+    return rows
+
+
+def measure(func, repeat):
+    # Wall time over `repeat` runs, then one more run under tracemalloc for the peak Python allocation
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {"median_s": statistics.median(times), "min_s": min(times), "peak_mb": peak / 2 ** 20}
+
+
+def row_count(value):
+    return len(value) if isinstance(value, (pd.DataFrame, list)) else None
+
+
+def first_state(cube):
+    geos = cube["geos"]
+    return geos["geo_desc"][geos["geo_level"] == "State"].iloc[0]
+
+
+def map_chart(cube, geo_level, geojson, locations, featureidkey):
+    year, metric = int(cube["years"][-1]), "total_costs_per_capita"
+    return create_map_chart(map_slice(cube, year, metric, geo_level), geojson, locations, featureidkey,
+                            metric, geo_level, year)
+
+
+# Stages in pipeline order; each takes the values of the stages before it
+STAGES = [
+    *[stage for name, module in MODULES.items() for stage in [
+        (f"fetch:{name}", lambda values, module=module: module.fetch_data()),
+        (f"process:{name}", lambda values, name=name, module=module: module.process_data(values[f"fetch:{name}"])),
+    ]],
+    ("pct_diff:state", lambda values: geo_data_retrieval.calculate_pct_diff(values["process:geo"])),
+    ("pct_diff:county", lambda values: geo_data_retrieval.calculate_pct_diff(
+        values["process:geo"], geo_levels=("National", "County"))),
+    ("search:build_index", lambda values: build_search_index(values["process:drugs_d"])),
+    ("search:filter", lambda values: [values["process:drugs_d"].iloc[search_index(values["search:build_index"], query)]
+                                      for query in SEARCH_QUERIES]),
+    ("cube:state", lambda values: build_geo_cube(values["pct_diff:state"])),
+    ("cube:county", lambda values: build_geo_cube(values["pct_diff:county"], "geo_code")),
+    ("figure:state_map", lambda values: map_chart(values["cube:state"], "State", get_us_state_geojson(),
+                                                  "geo_desc", "properties.STUSPS")),
+    ("figure:county_map", lambda values: map_chart(values["cube:county"], "County", get_us_county_geojson("medium"),
+                                                   "geo_code", "id")),
+    ("figure:breakdown_table", lambda values: create_cost_breakdown_chart(
+        values["cube:state"], int(values["cube:state"]["years"][-1]), first_state(values["cube:state"]))),
+    ("figure:multi_year", lambda values: create_multi_year_cost_chart(values["cube:state"], first_state(values["cube:state"]))),
+    # What Streamlit does with every figure on each rerun
+    ("serialize:state_map", lambda values: values["figure:state_map"].to_json()),
+    ("serialize:county_map", lambda values: values["figure:county_map"].to_json()),
+    ("serialize:multi_year", lambda values: values["figure:multi_year"].to_json()),
+]
+
+
+def run_scale(scale, repeat, only, recorded_dir=None, latency=0.0):
+    selected = [name for name, _ in STAGES if not only or name.startswith(tuple(only))]
+    if not selected:
+        return [], {}
+    # Stages after the last selected one are skipped; unselected stages before it still run,
+    # unmeasured, because later stages need their output
+    last = max(i for i, (name, _) in enumerate(STAGES) if name in selected)
+    # Boundaries are loaded before timing starts, as the dashboards keep them cached
+    get_us_state_geojson(), get_us_county_geojson("medium")
+
+    fixture_dir = tempfile.mkdtemp(prefix=f"ihi-bench-{scale}x-")
+    server = None
+    try:
+        fixture_rows = write_fixtures(fixture_dir, scale, recorded_dir)
+        server, base_url = start_server(fixture_dir, latency=latency)
+        # Every fetch goes over HTTP to the stub, whatever the environment says
+        cms_api.BASE_URL, cms_api.FIXTURE_DIR = base_url, None
+
+        results, values = [], {}
+        for name, func in STAGES[:last + 1]:
+            if name not in selected:
+                values[name] = func(values)
+                continue
+            values[name], timing = measure(lambda: func(values), repeat)
+            results.append({"stage": name, "scale": scale, "rows": row_count(values[name]), **timing})
+            print(f"{scale:>4}x {name:<24} {timing['median_s'] * 1000:10.1f} ms {timing['peak_mb']:9.1f} MB",
+                  file=sys.stderr)
+        return results, fixture_rows
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    previous = {(result["stage"], result["scale"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["stage"], result["scale"]))
+        if before is None:
+            continue
+        ratio = result["median_s"] / before["median_s"] if before["median_s"] else float("inf")
+        regressed = ratio > threshold and result["median_s"] - before["median_s"] > MIN_DELTA
+        print(f"{result['scale']:>4}x {result['stage']:<24} {before['median_s'] * 1000:10.1f} -> "
+              f"{result['median_s'] * 1000:10.1f} ms  x{ratio:5.2f}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(result)
+    return regressions
+
+
+def import_time(module):
+    # Seconds a fresh interpreter spends importing module, and which of UI_PACKAGES it loaded
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start); print(*[name for name in {UI_PACKAGES!r} if name in sys.modules])")
+    lines = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+    return float(lines[0]), lines[1].split() if len(lines) > 1 else []
+
+
+def check_imports(repeat, allowance=IMPORT_ALLOWANCE):
+    # Median import time of every headless module against the pandas baseline; returns the failures
+    baseline = statistics.median(import_time("pandas")[0] for _ in range(repeat))
+    print(f"{'pandas (baseline)':<24} {baseline * 1000:10.1f} ms")
+    failures = []
+    for module in HEADLESS_MODULES:
+        runs = [import_time(module) for _ in range(repeat)]
+        seconds = statistics.median(run[0] for run in runs)
+        loaded = sorted({name for run in runs for name in run[1]})
+        problems = ([f"over budget by {(seconds - baseline - allowance) * 1000:.0f} ms"]
+                    if seconds > baseline + allowance else []) + [f"imports {name}" for name in loaded]
+        print(f"{module:<24} {seconds * 1000:10.1f} ms{'  ' + ', '.join(problems) if problems else ''}")
+        if problems:
+            failures.append(module)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CMS data pipeline and dashboard views")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="run only stages starting with these prefixes, e.g. fetch search")
+    parser.add_argument("--fixtures", help="directory of recorded <dataset_id>.json files to scale instead of synthetic data")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency the stub adds to every request")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--imports", action="store_true",
+                        help="only check the headless modules' import time and dependencies")
+    args = parser.parse_args()
+
+    if args.imports:
+        failures = check_imports(args.repeat)
+        if failures:
+            print(f"{len(failures)} module(s) failed the import budget", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    results, fixture_rows = [], {}
+    for scale in args.scales:
+        scale_results, fixture_rows[scale] = run_scale(scale, args.repeat, args.only, args.fixtures, args.latency)
+        results.extend(scale_results)
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "source": args.fixtures or "synthetic",
+            "fixture_rows": fixture_rows,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed beyond x{args.threshold}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
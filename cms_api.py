@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+
+import pandas as pd
+
+from instrumentation import carry_trace, span
+from schema import merge_counts
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library parser is several times slower on full pages
+    orjson = None
+
+BASE_URL = os.environ.get("IHI_CMS_BASE_URL", "https://data.cms.gov/data-api/v1/dataset")
+PAGE_SIZE = 5000  # The maximum allowed by the CMS API
+MAX_WORKERS = 8
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+REQUEST_TIMEOUT = 60
+# When set, datasets are read from <FIXTURE_DIR>/<dataset_id>.json instead of the network
+FIXTURE_DIR = os.environ.get("IHI_FIXTURE_DIR")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class FetchError(RuntimeError):
+    pass
+
+
+def get_session():
+    # One keep-alive session per process, with a connection pool large enough for every worker.
+    # requests is imported here so jobs that only read fixtures or the cache never load it
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def get_response(url, params=None, headers=None, retries=MAX_RETRIES):
+    # Returns 200 and 304 (not modified) responses; anything else is retried with backoff
+    import requests
+
+    session = get_session()
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            with span("http.get", url=url, offset=(params or {}).get("offset"), attempt=attempt) as current:
+                response = session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+                current.set(status=response.status_code, bytes=len(response.content))
+        except requests.RequestException as exc:
+            error = str(exc)
+        else:
+            if response.status_code in (200, 304):
+                return response
+            error = f"{response.status_code} {response.text[:200]}"
+            # Client errors other than rate limiting will not succeed on retry
+            if response.status_code < 500 and response.status_code != 429:
+                break
+        if attempt < retries:
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+    raise FetchError(f"Failed to retrieve data from {url}: {error}")
+
+
+def loads(content):
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+def decode_json(response):
+    with span("json.decode", bytes=len(response.content)) as current:
+        data = loads(response.content)
+        current.set(rows_out=len(data) if isinstance(data, list) else None)
+    return data
+
+
+def get_json(url, params=None, retries=MAX_RETRIES):
+    return decode_json(get_response(url, params, retries=retries))
+
+
+def build_query(filters=None, columns=None):
+    # filters are (column, operator, value) tuples, ANDed together; columns limits the returned fields
+    params = {}
+    if columns:
+        params["column"] = ",".join(columns)
+    for i, (column, operator, value) in enumerate(filters or []):
+        if operator == "=":
+            params[f"filter[{column}]"] = value
+            continue
+        key = f"filter[f{i}][condition]"
+        params[f"{key}[path]"] = column
+        params[f"{key}[operator]"] = operator
+        if isinstance(value, (list, tuple)):
+            for j, item in enumerate(value, start=1):
+                params[f"{key}[value][{j}]"] = item
+        else:
+            params[f"{key}[value]"] = value
+    return params
+
+
+def compare(field, operator, value):
+    if operator in ("IN", "NOT IN"):
+        found = str(field) in {str(item) for item in value}
+        return found if operator == "IN" else not found
+    try:
+        field, value = float(field), float(value)
+    except (TypeError, ValueError):
+        field, value = str(field), str(value)
+    if operator == "=":
+        return field == value
+    if operator == "<>":
+        return field != value
+    if operator == ">":
+        return field > value
+    if operator == ">=":
+        return field >= value
+    if operator == "<":
+        return field < value
+    if operator == "<=":
+        return field <= value
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def filter_records(records, filters=None, columns=None):
+    # Local equivalent of the data-api's filter[...] and column= handling, used for fixtures and the stub server
+    if filters:
+        records = [record for record in records
+                   if all(compare(record.get(column), operator, value) for column, operator, value in filters)]
+    if columns:
+        records = [{column: record.get(column) for column in columns} for record in records]
+    return records
+
+
+def count_rows(dataset_id, query=None):
+    stats = get_json(f"{BASE_URL}/{dataset_id}/data/stats", params=query)
+    return int(stats["found_rows"])
+
+
+def fetch_page(dataset_id, offset, size=PAGE_SIZE, query=None):
+    return get_json(f"{BASE_URL}/{dataset_id}/data", params={**(query or {}), "size": size, "offset": offset})
+
+
+def fetch_page_update(dataset_id, offset, size=PAGE_SIZE, query=None, validator=None):
+    # validator holds the ETag and content digest of the page from the previous sync. Returns
+    # (None, validator) when the page has not changed, otherwise (page_data, new validator)
+    headers = {"If-None-Match": validator["etag"]} if validator and validator.get("etag") else None
+    response = get_response(f"{BASE_URL}/{dataset_id}/data",
+                            params={**(query or {}), "size": size, "offset": offset}, headers=headers)
+    if response.status_code == 304:
+        return None, validator
+    new_validator = {"etag": response.headers.get("ETag"), "digest": hashlib.sha256(response.content).hexdigest()}
+    if validator and validator.get("digest") == new_validator["digest"]:
+        return None, new_validator
+    return decode_json(response), new_validator
+
+
+def fixture_path(dataset_id):
+    return os.path.join(FIXTURE_DIR, f"{dataset_id}.json")
+
+
+def get_dataset_version(dataset_id):
+    # Last-Modified of the data endpoint identifies the published revision. Its ETag only covers the
+    # requested page, so without Last-Modified this is None and a sync checks every page's validator
+    if FIXTURE_DIR:
+        return str(os.path.getmtime(fixture_path(dataset_id)))
+    import requests
+
+    session = get_session()
+    try:
+        response = session.head(f"{BASE_URL}/{dataset_id}/data", params={"size": 1}, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return response.headers.get("Last-Modified")
+
+
+def iter_pages(dataset_id, filters=None, columns=None, size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    if FIXTURE_DIR:
+        with span("fixture.read", dataset_id=dataset_id) as current:
+            with open(fixture_path(dataset_id), "rb") as f:
+                data = filter_records(loads(f.read()), filters, columns)
+            current.set(rows_out=len(data))
+        for offset in range(0, len(data), size):
+            yield data[offset:offset + size]
+        return
+
+    query = build_query(filters, columns)
+
+    def fetch(offset):
+        return fetch_page(dataset_id, offset, size, query)
+
+    offsets = page_offsets(dataset_id, query, size)
+    if offsets is None:
+        yield from walk_pages(fetch, lambda page_data: not page_data, size)
+    else:
+        yield from fetch_in_order(fetch, offsets, max_workers)
+
+
+def page_offsets(dataset_id, query, size=PAGE_SIZE):
+    # Offsets of every page, from the stats endpoint's row count; None when the rows cannot be counted
+    try:
+        return range(0, count_rows(dataset_id, query), size)
+    except (FetchError, KeyError, TypeError, ValueError):
+        return None
+
+
+def walk_pages(fetch, past_end, size=PAGE_SIZE):
+    # Without a row count we can only walk the pages one at a time until past_end(result) says the
+    # last one has been passed, e.g. an empty page came back
+    offset = 0
+    while True:
+        result = fetch(offset)
+        if past_end(result):
+            return
+        yield result
+        offset += size
+
+
+def fetch_in_order(fetch, offsets, max_workers=MAX_WORKERS):
+    # Keep a bounded window of requests in flight and hand results out strictly in offset order. The
+    # first page to fail is raised right away: queued pages are cancelled or skip their request, and
+    # requests still in flight are left to finish in the background instead of being waited for
+    offsets = iter(offsets)
+    fetch = carry_trace(fetch)
+    failure, failure_lock = Future(), threading.Lock()
+
+    def run(offset):
+        if failure.done():
+            raise FetchError("Skipped after an earlier page failed")
+        try:
+            return fetch(offset)
+        except BaseException as exc:
+            with failure_lock:
+                if not failure.done():
+                    failure.set_exception(exc)
+            raise
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = deque(executor.submit(run, offset) for offset in islice(offsets, max_workers * 2))
+        while pending:
+            wait([pending[0], failure], return_when=FIRST_COMPLETED)
+            if failure.done():
+                failure.result()
+            result = pending.popleft().result()
+            for offset in islice(offsets, 1):
+                pending.append(executor.submit(run, offset))
+            yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_page_updates(dataset_id, validators, filters=None, columns=None, size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    # validators maps offset -> validator from the previous sync. Yields (offset, page_data, validator)
+    # in offset order, with page_data None for pages that have not changed
+    if FIXTURE_DIR:
+        with open(fixture_path(dataset_id), "rb") as f:
+            data = filter_records(loads(f.read()), filters, columns)
+        for offset in range(0, len(data), size):
+            page_data = data[offset:offset + size]
+            validator = {"etag": None, "digest": hashlib.sha256(json.dumps(page_data).encode()).hexdigest()}
+            unchanged = validators.get(offset, {}).get("digest") == validator["digest"]
+            yield offset, None if unchanged else page_data, validator
+        return
+
+    query = build_query(filters, columns)
+
+    def fetch(offset):
+        return (offset, *fetch_page_update(dataset_id, offset, size, query, validators.get(offset)))
+
+    offsets = page_offsets(dataset_id, query, size)
+    if offsets is None:
+        # Unchanged pages come back as None; an empty list is the end of the data
+        yield from walk_pages(fetch, lambda result: result[1] is not None and not result[1], size)
+    else:
+        yield from fetch_in_order(fetch, offsets, max_workers)
+
+
+def records_to_frame(page_data, decode=None):
+    # decode turns a page's records into a DataFrame chunk, e.g. schema.decode_records parsing
+    # numeric columns while transposing; without one the records go through DataFrame.from_records
+    return decode(page_data) if decode is not None else pd.DataFrame.from_records(page_data)
+
+
+def fetch_frame(dataset_id, filters=None, columns=None, chunk_filter=None, size=PAGE_SIZE, max_workers=MAX_WORKERS,
+                decode=None):
+    # Each page becomes a DataFrame chunk as soon as it arrives; chunk_filter drops unwanted rows
+    # before the page's records are released, so only the kept rows accumulate
+    with span("fetch.frame", dataset_id=dataset_id) as current:
+        chunks = []
+        for page_data in iter_pages(dataset_id, filters, columns, size, max_workers):
+            with span("frame.chunk", rows_in=len(page_data)) as chunk_span:
+                chunk = records_to_frame(page_data, decode)
+                del page_data
+                if chunk_filter is not None:
+                    chunk = chunk_filter(chunk)
+                chunk_span.set(rows_out=len(chunk))
+            chunks.append(chunk)
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        if decode is not None:
+            df.attrs["coercion"] = merge_counts(chunks)
+        current.set(pages=len(chunks), rows_out=len(df))
+    return df
@@ -0,0 +1,122 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from cms_api import filter_records
+
+# Local stand-in for the CMS data-api: serves <fixture_dir>/<dataset_id>.json with the same
+# size/offset paging, filter[...] conditions, column= projection, data/stats endpoint and
+# ETag/If-None-Match revalidation.
+# Point the app at it with IHI_CMS_BASE_URL=http://127.0.0.1:<port>/data-api/v1/dataset
+
+PATH_PATTERN = re.compile(r"^/data-api/v1/dataset/(?P<dataset_id>[^/]+)/data(?P<stats>/stats)?/?$")
+CONDITION_PATTERN = re.compile(r"^filter\[(?P<group>[^\]]+)\]\[condition\]\[(?P<part>path|operator|value)\](?P<index>\[\d+\])?$")
+EQUALS_PATTERN = re.compile(r"^filter\[(?P<column>[^\]]+)\]$")
+
+
+def parse_query(pairs):
+    filters, columns, conditions = [], None, {}
+    for key, value in pairs:
+        if key == "column":
+            columns = value.split(",")
+        elif EQUALS_PATTERN.match(key):
+            filters.append((EQUALS_PATTERN.match(key)["column"], "=", value))
+        elif CONDITION_PATTERN.match(key):
+            match = CONDITION_PATTERN.match(key)
+            condition = conditions.setdefault(match["group"], {"value": []})
+            if match["part"] == "value" and match["index"]:
+                condition["value"].append(value)
+            elif match["part"] == "value":
+                condition["value"] = value
+            else:
+                condition[match["part"]] = value
+    for condition in conditions.values():
+        filters.append((condition["path"], condition.get("operator", "="), condition["value"]))
+    return filters, columns
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fixture_dir = "."
+    datasets = {}
+    lock = threading.Lock()
+    # Extra latency per request in seconds, to mimic a remote server
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def load_dataset(self, dataset_id):
+        with self.lock:
+            if dataset_id not in self.datasets:
+                path = os.path.join(self.fixture_dir, f"{dataset_id}.json")
+                with open(path) as f:
+                    self.datasets[dataset_id] = (json.load(f), formatdate(os.path.getmtime(path), usegmt=True))
+            return self.datasets[dataset_id]
+
+    def respond(self, status, body, last_modified=None, head=False):
+        payload = json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, payload = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        if last_modified:
+            self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        if not head:
+            self.wfile.write(payload)
+
+    def handle_request(self, head=False):
+        url = urlparse(self.path)
+        match = PATH_PATTERN.match(url.path)
+        if not match:
+            return self.respond(404, {"error": "not found"}, head=head)
+        try:
+            records, last_modified = self.load_dataset(match["dataset_id"])
+        except FileNotFoundError:
+            return self.respond(404, {"error": "unknown dataset"}, head=head)
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+        pairs = parse_qsl(url.query)
+        filters, columns = parse_query(pairs)
+        found = filter_records(records, filters)
+        if match["stats"]:
+            return self.respond(200, {"found_rows": len(found), "total_rows": len(records)}, last_modified, head)
+        params = dict(pairs)
+        offset, size = int(params.get("offset", 0)), int(params.get("size", 1000))
+        page = filter_records(found[offset:offset + size], columns=columns)
+        return self.respond(200, page, last_modified, head)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+
+def start_server(fixture_dir, port=0, latency=0.0):
+    # Runs in a daemon thread; returns the server and the base URL to use for IHI_CMS_BASE_URL
+    handler = type("Handler", (StubHandler,), {"fixture_dir": fixture_dir, "datasets": {}, "latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/data-api/v1/dataset"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CMS dataset fixtures over a local data-api stub")
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    server, base_url = start_server(args.fixture_dir, args.port, args.latency)
+    print(f"Serving fixtures from {args.fixture_dir} at {base_url}")
+    threading.Event().wait()
@@ -0,0 +1,92 @@
+import threading
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import artifacts
+import drugs_b_data_retrieval
+import drugs_d_data_retrieval
+import geo_data_retrieval
+from async_loader import load_progressively
+from dataset_cache import CACHE_TTL, cached_version
+from dataset_registry import session_value
+from drug_search import build_drug_lookup
+from sort_orders import build_sort_orders
+
+# Loading plumbing shared by the dashboards. Every loader reads the artifacts published by
+# precompute.py when there are any and only falls back to fetching and deriving the data itself
+# otherwise. Loaded values live in the process-wide dataset registry, so all sessions share one
+# read-only copy per data version
+
+DATASETS = {
+    'geo': geo_data_retrieval,
+    'drugs_b': drugs_b_data_retrieval,
+    'drugs_d': drugs_d_data_retrieval,
+}
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def data_version(dataset):
+    # Runs at most once per TTL and dataset for all sessions; without artifacts this is where the
+    # cached dataset is revalidated against CMS
+    if artifacts.current_version() is None:
+        DATASETS[dataset].load_data()
+    return artifacts.current_version() or cached_version(DATASETS[dataset].DATASET_ID)
+
+
+def shared(dataset, name, load, version=None):
+    # name's value for this session from the dataset registry, loaded once per version (by default
+    # the dataset's data version)
+    return session_value(st.session_state, f'{dataset}/{name}', version or data_version(dataset), load)
+
+
+def processed_frame(dataset):
+    df = artifacts.load_table(dataset, 'processed')
+    return df if df is not None else DATASETS[dataset].load_data()
+
+
+def load_processed_frame(dataset):
+    # The processed frame is memory-mapped from the artifact or cache file, so the registry shares it
+    # without a copy; the drug tables read their pages from it at full precision
+    return shared(dataset, 'processed', lambda: processed_frame(dataset))
+
+
+def load_drug_lookup(dataset):
+    # Dropdown options, name -> rows and the drug tensor the trend charts read
+    def build():
+        lookup = artifacts.load_lookup(dataset, 'lookup')
+        return lookup if lookup is not None else build_drug_lookup(processed_frame(dataset))
+
+    return shared(dataset, 'lookup', build)
+
+
+def load_sort_orders(dataset):
+    def build():
+        orders = artifacts.load_pickle(dataset, 'sort_orders')
+        return orders if orders is not None else build_sort_orders(processed_frame(dataset))
+
+    return shared(dataset, 'sort_orders', build)
+
+
+def run_page(loads, sections, slots, render, progress):
+    # Starts every load in the background and draws each section with render(section, loaded) as soon
+    # as its loads are in (see async_loader.load_progressively). progress is the page's progress bar;
+    # a section whose loads failed gets an error in its slot instead. Returns the failed loads
+    def report_progress(name, error, seconds, done, total):
+        status = "Failed to load" if error is not None else "Loaded"
+        progress.progress(done / total, text=f"{status} {name} in {seconds:.1f}s ({done}/{total})")
+
+    # Loads run in worker threads that need this session's script context for the dataset registry
+    script_context = get_script_run_ctx()
+    failed, blocked = load_progressively(
+        loads, sections, render, report_progress,
+        thread_setup=lambda: add_script_run_ctx(threading.current_thread(), script_context))
+
+    for section, missing in blocked.items():
+        slots[section].error("Could not load " + "; ".join(f"{name} ({failed[name]})" for name in missing)
+                             + ". Reload the page to try again.")
+    if failed:
+        progress.progress(1.0, text=f"Finished with errors: {', '.join(failed)}")
+    else:
+        progress.empty()
+    return failed
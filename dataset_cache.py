@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from cms_api import get_dataset_version, iter_page_updates, records_to_frame
+from instrumentation import span
+from schema import page_decoder
+
+CACHE_DIR = os.environ.get("IHI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache"))
+# Seconds a cached dataset is trusted before it is revalidated against the CMS metadata
+CACHE_TTL = int(os.environ.get("IHI_CACHE_TTL", 24 * 60 * 60))
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def key_lock(key):
+    # Loads of one cache key from concurrent threads run one at a time, so the first (re)builds
+    # the files and the others then find them fresh instead of building them again
+    with _key_locks_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def cache_paths(key):
+    return os.path.join(CACHE_DIR, f"{key}.feather"), os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def replace_file(path, write):
+    # write(tmp_path) fills a temp file unique to this call next to path, which then replaces path in
+    # one step. key_lock only orders threads, so this is what keeps server processes writing the same
+    # file at once from reading each other's partial files
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.",
+                                    suffix=".tmp")
+    os.close(fd)
+    # mkstemp makes the file readable by its owner only; the dashboards may run as another user than
+    # precompute.py
+    os.chmod(tmp_path, 0o644)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_meta(meta_path, meta):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+
+    replace_file(meta_path, write)
+
+
+def read_frame(data_path):
+    # Uncompressed Feather is memory-mapped, so numeric columns are served straight from the page cache
+    with span("cache.read", path=os.path.basename(data_path)) as current:
+        table = feather.read_table(data_path, memory_map=True)
+        df = table.to_pandas(split_blocks=True)
+        current.set(rows_out=len(df), bytes=table.nbytes)
+    return df
+
+
+def write_frame(df, data_path):
+    with span("cache.write", path=os.path.basename(data_path), rows_in=len(df)):
+        replace_file(data_path, lambda tmp_path: feather.write_feather(df.reset_index(drop=True), tmp_path,
+                                                                       compression="uncompressed"))
+
+
+def is_fresh(meta, dataset_id, ttl):
+    if time.time() - meta["checked_at"] < ttl:
+        return True
+    version = get_dataset_version(dataset_id)
+    # Without version metadata the cache is synced once the TTL expires, which checks every page's validator
+    return version is not None and version == meta.get("version")
+
+
+def concat_frames(frames):
+    # Concatenating categoricals with different categories falls back to object, so restore them
+    df = pd.concat(frames, ignore_index=True)
+    for column in frames[0].select_dtypes('category').columns:
+        df[column] = df[column].astype('category')
+    return df
+
+
+def sync_dataset(dataset_id, process, filters=None, columns=None, chunk_filter=None, key=None, ttl=CACHE_TTL,
+                 decode=None):
+    # Processed frame of a dataset, cached on disk, for row-wise process functions: the cache remembers each
+    # page's validator and the rows it produced, so a refresh re-downloads (via If-None-Match) and
+    # re-processes only pages that changed and splices them into the cached frame
+    key = key or dataset_id
+    with key_lock(key):
+        data_path, meta_path = cache_paths(key)
+        meta = read_meta(meta_path)
+        cached = meta is not None and "pages" in meta and os.path.exists(data_path)
+        if cached and is_fresh(meta, dataset_id, ttl):
+            if time.time() - meta["checked_at"] >= ttl:
+                meta["checked_at"] = time.time()
+                write_meta(meta_path, meta)
+            return read_frame(data_path)
+
+        version = get_dataset_version(dataset_id)
+        old_df = read_frame(data_path) if cached else None
+        old_pages = {page["offset"]: page for page in meta["pages"]} if cached else {}
+        validators = {offset: page["validator"] for offset, page in old_pages.items()}
+
+        chunks, pages, row_count, changed = [], [], 0, 0
+        with span("cache.sync", key=key) as current:
+            for offset, page_data, validator in iter_page_updates(dataset_id, validators, filters, columns):
+                if page_data is None:
+                    page = old_pages[offset]
+                    chunk = old_df.iloc[page["start"]:page["stop"]]
+                else:
+                    chunk = records_to_frame(page_data, decode)
+                    if chunk_filter is not None:
+                        chunk = chunk_filter(chunk)
+                    chunk = process(chunk)
+                    changed += 1
+                pages.append({"offset": offset, "validator": validator, "start": row_count, "stop": row_count + len(chunk)})
+                row_count += len(chunk)
+                chunks.append(chunk)
+            current.set(pages=len(pages), changed_pages=changed, rows_out=row_count)
+
+        now = time.time()
+        new_meta = {"dataset_id": dataset_id, "version": version, "built_at": now, "checked_at": now, "pages": pages}
+        if cached and not changed and len(pages) == len(old_pages):
+            # Nothing changed: keep the existing frame and its build time so derived caches stay valid
+            new_meta["built_at"] = meta["built_at"]
+            write_meta(meta_path, new_meta)
+            return old_df
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_frame(concat_frames(chunks) if chunks else pd.DataFrame(), data_path)
+        write_meta(meta_path, new_meta)
+        return read_frame(data_path)
+
+
+def load_processed(dataset_id, schema, process, filters=None, columns=None, chunk_filter=None, ttl=CACHE_TTL):
+    # sync_dataset for the retrieval modules, whose pages are decoded with their PROCESS_SCHEMA: when
+    # the CMS dataset changes or the TTL expires only the pages that changed are downloaded and
+    # processed again. ttl=0 revalidates against CMS now
+    return sync_dataset(dataset_id, process, filters, columns, chunk_filter, ttl=ttl, decode=page_decoder(schema))
+
+
+def partition_hashes(df, column):
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    partitions = df[column].astype(str).to_numpy()
+    return {partition: hashlib.sha256(row_hashes[partitions == partition].tobytes()).hexdigest()
+            for partition in sorted(set(partitions))}
+
+
+def load_derived(key, source_df, partition_column, derive):
+    # derive(rows) builds the derived table for a subset of source rows, one or more whole partitions
+    # at a time. Only partitions whose source rows changed since the last build are recomputed
+    with key_lock(key):
+        data_path, meta_path = cache_paths(key)
+        meta = read_meta(meta_path)
+        hashes = partition_hashes(source_df, partition_column)
+
+        if meta is not None and os.path.exists(data_path):
+            old_hashes = meta["partitions"]
+            changed = {partition for partition in hashes.keys() | old_hashes.keys()
+                       if hashes.get(partition) != old_hashes.get(partition)}
+            if not changed:
+                return read_frame(data_path)
+            cached_df = read_frame(data_path)
+            kept = cached_df[~cached_df[partition_column].astype(str).isin(changed)]
+            with span("cache.derive", key=key, partitions=len(changed)):
+                fresh = derive(source_df[source_df[partition_column].astype(str).isin(changed)])
+            derived_df = concat_frames([kept, fresh]).sort_values(partition_column, kind='stable', ignore_index=True)
+        else:
+            with span("cache.derive", key=key, partitions=len(hashes)):
+                derived_df = derive(source_df)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_frame(derived_df, data_path)
+        write_meta(meta_path, {"partitions": hashes, "built_at": time.time(), "checked_at": time.time()})
+        return read_frame(data_path)
+
+
+def cached_version(key):
+    # Token that changes whenever the cached frame is rebuilt, for keying structures derived from it
+    meta = read_meta(cache_paths(key)[1])
+    if meta is None:
+        return None
+    return f"{meta.get('version')}@{meta.get('built_at')}"
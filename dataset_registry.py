@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from dataset_cache import read_frame, write_frame
+
+# Process-wide registry of read-only datasets: each (name, version) is loaded once and every session
+# gets the same object. Sessions hold leases; once a newer version of a name has been loaded, older
+# versions are dropped as soon as their last lease is released.
+# With IHI_SHARED_MEMORY_DIR set (e.g. /dev/shm/ihi) frames are kept there as Arrow files and
+# memory-mapped, so every server process on the host shares one copy of their numeric columns
+SHARED_MEMORY_DIR = os.environ.get("IHI_SHARED_MEMORY_DIR")
+
+_entries = {}
+_latest = {}
+_registry_lock = threading.Lock()
+
+
+def shared_path(name, version):
+    return os.path.join(SHARED_MEMORY_DIR, re.sub(r"[^\w.-]+", "_", f"{name}@{version}") + ".feather")
+
+
+def is_read_only(df):
+    # True for frames whose numeric and categorical columns are read-only views of Arrow buffers,
+    # e.g. read from a memory-mapped cache or artifact file
+    for _, column in df.items():
+        if column.dtype == object:
+            continue
+        values = column.cat.codes.to_numpy() if isinstance(column.dtype, pd.CategoricalDtype) else column.to_numpy()
+        if values.flags.writeable:
+            return False
+    return True
+
+
+def freeze_frame(df, name, version):
+    # Round-tripping through Arrow gives zero-copy numpy columns backed by read-only buffers, so a
+    # session that tries to modify a shared frame in place gets an error instead of changing it for everyone.
+    # Frames that already are such views are shared as they are, without a private copy
+    if SHARED_MEMORY_DIR:
+        path = shared_path(name, version)
+        if not os.path.exists(path):
+            os.makedirs(SHARED_MEMORY_DIR, exist_ok=True)
+            write_frame(df, path)
+        return read_frame(path), path
+    if is_read_only(df):
+        return df, None
+    sink = pa.BufferOutputStream()
+    feather.write_feather(df.reset_index(drop=True), sink, compression="uncompressed")
+    table = feather.read_table(pa.BufferReader(sink.getvalue()))
+    return table.to_pandas(split_blocks=True), None
+
+
+def freeze(value, name, version):
+    if isinstance(value, pd.DataFrame):
+        return freeze_frame(value, name, version)
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for item in value.values():
+            if isinstance(item, (np.ndarray, dict)):
+                freeze(item, name, version)
+    return value, None
+
+
+def evict(key):
+    # Called with the registry lock held
+    entry = _entries.pop(key)
+    if entry["path"]:
+        try:
+            os.remove(entry["path"])
+        except OSError:
+            pass
+
+
+def get_entry(name, version, load):
+    key = (name, version)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = {"value": None, "refs": 0, "path": None, "ready": threading.Event(), "error": None}
+            loader = True
+        else:
+            loader = False
+        entry["refs"] += 1
+
+    if loader:
+        # Other sessions asking for the same version wait for this load instead of starting their own
+        try:
+            entry["value"], entry["path"] = freeze(load(), name, version)
+        except BaseException as error:
+            entry["error"] = error
+            with _registry_lock:
+                _entries.pop(key, None)
+            raise
+        finally:
+            entry["ready"].set()
+        with _registry_lock:
+            previous = _latest.get(name)
+            _latest[name] = version
+            if previous is not None and previous != version and (name, previous) in _entries:
+                if _entries[(name, previous)]["refs"] == 0:
+                    evict((name, previous))
+    else:
+        entry["ready"].wait()
+        if entry["error"] is not None:
+            raise entry["error"]
+    return entry
+
+
+def release(name, version):
+    key = (name, version)
+    with _registry_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return
+        entry["refs"] -= 1
+        if entry["refs"] <= 0 and _latest.get(name) != version:
+            evict(key)
+
+
+class Lease:
+    # A session's hold on one dataset version; released explicitly or when the session is garbage collected
+    def __init__(self, name, version, load):
+        self.name, self.version = name, version
+        self.value = get_entry(name, version, load)["value"]
+        self._finalizer = weakref.finalize(self, release, name, version)
+
+    def release(self):
+        self._finalizer()
+
+
+def session_value(session, name, version, load):
+    # session is a per-user mapping such as st.session_state. The lease on the version it used
+    # before is released when it moves to a new one
+    leases = session.setdefault("dataset_leases", {})
+    lease = leases.get(name)
+    if lease is None or lease.version != version:
+        leases[name] = Lease(name, version, load)
+        if lease is not None:
+            lease.release()
+    return leases[name].value
+
+
+def registry_stats():
+    with _registry_lock:
+        return {f"{name}@{version}": entry["refs"] for (name, version), entry in _entries.items()}
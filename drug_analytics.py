@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+from drug_search import normalize
+from drug_tensor import YEAR_COLUMN
+from instrumentation import traced
+
+# Additive metrics, so a generic's rows (one per brand) and the two parts can be summed
+METRICS = ['Total Spending', 'Total Claims', 'Total Beneficiaries', 'Total Dosage Units']
+
+
+def generic_key(name):
+    # Punctuation, case and word order differ between the datasets' generic names
+    # ("Insulin Glargine,Hum.Rec.Anlog"), so the key is the sorted normalized words
+    return ' '.join(sorted(set(normalize(name).split())))
+
+
+def metric_columns(df):
+    # (metric, year) -> column of the frame's METRICS columns
+    matches = (YEAR_COLUMN.match(column) for column in df.columns)
+    return {(match['metric'], match['year']): match.string for match in matches
+            if match and match['metric'] in METRICS}
+
+
+@traced('analytics.build')
+def build_drug_analytics(frames):
+    # frames maps each part (e.g. 'Part B') to its processed frame. Sums every generic's brands into a
+    # float64 generics x parts x metrics x years array, keyed by generic_key; 'present' marks the parts
+    # each generic appears in. The frames' values are summed, not the float32 tensor's, so totals stay
+    # exact past 2**24
+    parts = list(frames)
+    columns = {part: metric_columns(df) for part, df in frames.items()}
+    years = sorted({year for part_columns in columns.values() for _, year in part_columns})
+    part_keys, part_names = [], []
+    for df in frames.values():
+        # Each distinct spelling is normalized once
+        codes, spellings = pd.factorize(df['Generic Name'].to_numpy(dtype=object), use_na_sentinel=False)
+        keys = np.array([generic_key(name) for name in spellings], dtype=object)
+        part_keys.append(keys[codes])
+        part_names.append(df['Generic Name'].to_numpy(dtype=object))
+    codes, keys = pd.factorize(np.concatenate(part_keys))
+    # Each generic is shown under the first spelling seen for it
+    names = np.concatenate(part_names)[np.unique(codes, return_index=True)[1]]
+
+    values = np.zeros((len(keys), len(parts), len(METRICS), len(years)))
+    present = np.zeros((len(keys), len(parts)), dtype=bool)
+    offset = 0
+    for part, (name, df) in enumerate(frames.items()):
+        rows = codes[offset:offset + len(df)]
+        offset += len(df)
+        part_values = np.zeros((len(rows), len(METRICS), len(years)))
+        for (metric, year), column in columns[name].items():
+            part_values[:, METRICS.index(metric), years.index(year)] = np.nan_to_num(
+                df[column].to_numpy(dtype=np.float64))
+        np.add.at(values, (rows, part), part_values)
+        present[rows, part] = True
+    return {
+        'keys': np.asarray(keys, dtype=object),
+        'names': names,
+        'key_index': {key: i for i, key in enumerate(keys)},
+        'parts': parts,
+        'metrics': list(METRICS),
+        'years': years,
+        'values': values,
+        'present': present,
+    }
+
+
+def part_values(analytics, metric, part=None):
+    # generics x years of one metric for one part, or for both parts together when part is None
+    values = analytics['values'][:, :, analytics['metrics'].index(metric)]
+    return values.sum(axis=1) if part is None else values[:, analytics['parts'].index(part)]
+
+
+def top_rows(scores, n, eligible=None):
+    # Positions of the n largest finite scores, best first. argpartition finds them in linear time,
+    # so only those n are sorted
+    valid = np.isfinite(scores) if eligible is None else np.isfinite(scores) & eligible
+    candidates = np.flatnonzero(valid)
+    if n < len(candidates):
+        candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def growth(analytics, start_year, end_year, metric='Total Spending', part=None):
+    # Per-generic change, percent change and compound annual growth rate (%) between two years;
+    # NaN where the start year has nothing to grow from
+    values = part_values(analytics, metric, part)
+    start = values[:, analytics['years'].index(str(start_year))]
+    end = values[:, analytics['years'].index(str(end_year))]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(start > 0, end / start, np.nan)
+        cagr = (ratio ** (1 / (int(end_year) - int(start_year))) - 1) * 100
+    return {
+        f'{metric} {start_year}': start,
+        f'{metric} {end_year}': end,
+        'Change': end - start,
+        'Percent Change': (ratio - 1) * 100,
+        'CAGR (%)': cagr,
+    }
+
+
+def ranking_frame(analytics, rows, columns):
+    frame = pd.DataFrame({'Generic Name': analytics['names'][rows]})
+    for part, in_part in zip(analytics['parts'], analytics['present'][rows].T):
+        frame[f'In {part}'] = in_part
+    for name, values in columns.items():
+        frame[name] = values[rows]
+    return frame
+
+
+def top_spending(analytics, year, n=10, metric='Total Spending', part=None, in_all_parts=False):
+    # The n generics with the largest metric in a year, for one part or both combined
+    values = part_values(analytics, metric, part)
+    scores = values[:, analytics['years'].index(str(year))]
+    eligible = analytics['present'].all(axis=1) if in_all_parts else None
+    columns = {f'{part} {metric} {year}': analytics['values'][:, i, analytics['metrics'].index(metric),
+                                                             analytics['years'].index(str(year))]
+               for i, part in enumerate(analytics['parts'])}
+    columns[f'{metric} {year}'] = scores
+    return ranking_frame(analytics, top_rows(scores, n, eligible), columns)
+
+
+def top_growth(analytics, start_year, end_year, n=10, by='CAGR (%)', metric='Total Spending', part=None,
+               largest=True, in_all_parts=False):
+    # The n generics growing fastest (or, with largest=False, shrinking most) by one of growth()'s measures
+    measures = growth(analytics, start_year, end_year, metric, part)
+    scores = measures[by] if largest else -measures[by]
+    eligible = analytics['present'].all(axis=1) if in_all_parts else None
+    return ranking_frame(analytics, top_rows(scores, n, eligible), measures)
+
+
+def drug_history(analytics, name, metric='Total Spending'):
+    # One generic's yearly metric in each part it appears in (years x parts); None if it is in neither
+    row = analytics['key_index'].get(generic_key(name))
+    if row is None:
+        return None
+    values = analytics['values'][row, :, analytics['metrics'].index(metric)]
+    history = pd.DataFrame(values.T, index=pd.Index(analytics['years'], name='Year'), columns=analytics['parts'])
+    return history.loc[:, analytics['present'][row]]
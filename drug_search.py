@@ -0,0 +1,110 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from drug_tensor import build_drug_tensor, metric_series
+from instrumentation import traced
+
+# Queries shorter than this have too few trigrams to rank on and use a plain substring match
+MIN_TRIGRAM_QUERY = 3
+# Minimum trigram similarity for a name to count as a fuzzy match when nothing contains the query
+MIN_SIMILARITY = 0.4
+
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower()).strip()
+
+
+def trigrams(text):
+    # Every word is padded like pg_trgm so prefixes and word ends carry their own trigrams
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@traced('search.build_index')
+def build_search_index(df, columns=('Brand Name', 'Generic Name')):
+    # Postings map each trigram to the names containing it; a name's id is column * row_count + row
+    row_count = len(df)
+    names = [np.array([normalize(value) for value in df[column]], dtype=object) for column in columns]
+    postings = {}
+    gram_counts = np.zeros(row_count * len(columns), dtype=np.int32)
+    for column, column_names in enumerate(names):
+        for row, name in enumerate(column_names):
+            name_id = column * row_count + row
+            grams = trigrams(name)
+            gram_counts[name_id] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+    return {
+        'names': names,
+        'postings': {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()},
+        'gram_counts': gram_counts,
+        'row_count': row_count,
+    }
+
+
+def substring_rows(index, query, rows=None):
+    if rows is None:
+        rows = np.arange(index['row_count'])
+    found = np.zeros(len(rows), dtype=bool)
+    for names in index['names']:
+        found |= np.array([query in name for name in names[rows]], dtype=bool)
+    return rows[found]
+
+
+@traced('search.query')
+def search_index(index, query, limit=None):
+    # Returns matching row positions, best match first. Rows whose brand or generic name contains
+    # the query are returned ranked by trigram similarity; if there are none, the closest names by
+    # similarity are returned instead so typos still find the drug
+    query = normalize(query)
+    row_count = index['row_count']
+    if not query:
+        return np.arange(row_count)
+    if len(query) < MIN_TRIGRAM_QUERY:
+        return substring_rows(index, query)[:limit]
+
+    query_grams = trigrams(query)
+    matched = [index['postings'][gram] for gram in query_grams if gram in index['postings']]
+    if not matched:
+        return np.array([], dtype=np.int64)
+    overlap = np.bincount(np.concatenate(matched), minlength=len(index['gram_counts']))
+    # Jaccard similarity per name, then the better of a row's brand and generic names
+    similarity = overlap / (len(query_grams) + index['gram_counts'] - overlap)
+    similarity = similarity.reshape(-1, row_count).max(axis=0)
+
+    # Any name containing the query shares at least one of its trigrams, so only those rows are checked
+    candidates = substring_rows(index, query, np.flatnonzero(similarity > 0))
+    if not len(candidates):
+        candidates = np.flatnonzero(similarity >= MIN_SIMILARITY)
+    candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+    return candidates[:limit]
+
+
+@traced('search.build_lookup')
+def build_drug_lookup(df, columns=('Brand Name', 'Generic Name')):
+    # Sorted dropdown options, normalized name -> row positions, and the drug tensor so a
+    # drug's trend is a single slice
+    options = pd.concat([df[column] for column in columns]).unique()
+    options.sort()
+    rows = {}
+    for column in columns:
+        for row, name in enumerate(df[column]):
+            rows.setdefault(normalize(name), []).append(row)
+    return {
+        'options': options,
+        'rows': {name: np.unique(positions) for name, positions in rows.items()},
+        'tensor': build_drug_tensor(df, columns),
+    }
+
+
+def lookup_rows(lookup, name):
+    return lookup['rows'].get(normalize(name), np.array([], dtype=np.int64))
+
+
+def lookup_trend(lookup, row, metric):
+    return metric_series(lookup['tensor'], row, metric)
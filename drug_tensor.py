@@ -0,0 +1,62 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# "<Metric> <Year>" columns of the wide drug spending tables
+YEAR_COLUMN = re.compile(r'^(?P<metric>.+) (?P<year>\d{4})$')
+
+
+def build_drug_tensor(df, name_columns=('Brand Name', 'Generic Name')):
+    # Packs the yearly columns into a float32 drugs x metrics x years array for the trend charts, with
+    # the name columns as categoricals. float32 keeps about 7 significant digits, so tables and totals
+    # read the processed frame instead
+    metrics, years, positions = [], [], {}
+    for column in df.columns:
+        match = YEAR_COLUMN.match(column)
+        if match and column not in name_columns:
+            if match['metric'] not in metrics:
+                metrics.append(match['metric'])
+            if match['year'] not in years:
+                years.append(match['year'])
+            positions[column] = (match['metric'], match['year'])
+    years.sort()
+
+    values = np.full((len(df), len(metrics), len(years)), np.nan, dtype=np.float32)
+    for column, (metric, year) in positions.items():
+        values[:, metrics.index(metric), years.index(year)] = df[column].to_numpy(dtype=np.float32)
+
+    names = pd.DataFrame({column: pd.Categorical(df[column]) for column in name_columns})
+    return {
+        'names': names,
+        'metrics': metrics,
+        'years': years,
+        'values': values,
+    }
+
+
+def metric_index(tensor, metric):
+    return tensor['metrics'].index(metric)
+
+
+def metric_series(tensor, row, metric):
+    # One drug's values for a metric across every year
+    return tensor['values'][row, metric_index(tensor, metric), :]
+
+
+def to_long(tensor, rows=None, metrics=None):
+    # Long (names, Metric, Year, Value) view for charts
+    rows = np.arange(len(tensor['values'])) if rows is None else np.atleast_1d(rows)
+    metrics = metrics or tensor['metrics']
+    metric_positions = [metric_index(tensor, metric) for metric in metrics]
+    values = tensor['values'][np.ix_(rows, metric_positions, np.arange(len(tensor['years'])))]
+    row_count, metric_count, year_count = values.shape
+
+    long = {
+        column: np.repeat(np.asarray(tensor['names'][column])[rows], metric_count * year_count)
+        for column in tensor['names']
+    }
+    long['Metric'] = np.tile(np.repeat(metrics, year_count), row_count)
+    long['Year'] = np.tile(np.array(tensor['years'], dtype=int), row_count * metric_count)
+    long['Value'] = values.ravel()
+    return pd.DataFrame(long)
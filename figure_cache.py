@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from instrumentation import span
+
+# Process-wide LRU of serialized Plotly figures, shared by every session, so a selection any user has
+# already looked at is sent without building or serializing its figure again. Keys are
+# (data version, view, year, metric, selection). Entries are evicted least recently used first once
+# their specs add up to more than IHI_FIGURE_CACHE_MB. Maps keep a placeholder where their GeoJSON
+# goes; each boundary file is serialized once and spliced in when the figure is sent
+MAX_BYTES = int(float(os.environ.get("IHI_FIGURE_CACHE_MB", 64)) * 2 ** 20)
+GEOJSON_PLACEHOLDER = "__ihi_geojson__"
+# Same config st.plotly_chart sends by default
+CHART_CONFIG = json.dumps({"showLink": False, "linkText": False})
+# show_figure only enqueues specs directly on the Streamlit release pinned in requirements.txt,
+# whose private element API it relies on
+ENQUEUE_STREAMLIT_VERSION = "1.32.2"
+
+
+class FigureCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._specs = OrderedDict()
+        self._geojson = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def geojson_text(self, geojson_key, geojson):
+        # geojson_key is (name, version); a newer version of a name replaces the older one
+        import plotly.io.json
+
+        name, version = geojson_key
+        with self._lock:
+            cached = self._geojson.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with span("figure.geojson", geojson=name):
+            text = plotly.io.json.to_json_plotly(geojson)
+        with self._lock:
+            self._geojson[name] = (version, text)
+        return text
+
+    def spec(self, key, build, geojson=None, geojson_key=None):
+        # The figure's JSON as st.plotly_chart would send it; build() only runs on a miss. Figures
+        # with geojson have it swapped for the placeholder before they are serialized
+        with self._lock:
+            entry = self._specs.get(key)
+            if entry is not None:
+                self._specs.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            # Two sessions missing the same key at once both build it; the second store wins
+            with span("figure.build", view=key[1]):
+                entry = self.serialize(build(), geojson_key if geojson is not None else None)
+            self.store(key, entry)
+        if len(entry["parts"]) == 1:
+            return entry["parts"][0]
+        return self.geojson_text(entry["geojson"], geojson).join(entry["parts"])
+
+    def serialize(self, fig, geojson_key):
+        import plotly.io
+
+        if geojson_key is not None:
+            fig.update_traces(geojson=GEOJSON_PLACEHOLDER)
+        parts = plotly.io.to_json(fig, validate=False).split(json.dumps(GEOJSON_PLACEHOLDER))
+        return {"parts": parts, "geojson": geojson_key, "bytes": sum(map(len, parts))}
+
+    def store(self, key, entry):
+        if entry["bytes"] > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._specs.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous["bytes"]
+            self._specs[key] = entry
+            self._bytes += entry["bytes"]
+            while self._bytes > self.max_bytes:
+                _, evicted = self._specs.popitem(last=False)
+                self._bytes -= evicted["bytes"]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._specs), "mb": round(self._bytes / 2 ** 20, 2),
+                    "max_mb": round(self.max_bytes / 2 ** 20, 2), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else None, "evictions": self.evictions,
+                    "geojson": len(self._geojson)}
+
+
+FIGURES = FigureCache()
+
+
+def show_figure(key, build, geojson=None, geojson_key=None, container=None):
+    # st.plotly_chart for cached figures: build() makes the Plotly figure on a miss, geojson (with
+    # geojson_key = (name, version)) is the boundaries a map draws and container a placeholder to draw
+    # into instead of the page. st.plotly_chart validates and serializes every figure it is given, so
+    # on the pinned Streamlit the cached spec is put into the chart element directly
+    import streamlit as st
+
+    spec = FIGURES.spec(key, build, geojson, geojson_key)
+    if st.__version__ != ENQUEUE_STREAMLIT_VERSION:
+        # Any other release gets the public API, which parses and validates the spec again
+        return (st if container is None else container).plotly_chart(json.loads(spec))
+
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart
+
+    container = st._main if container is None else container
+    proto = PlotlyChart()
+    proto.figure.spec = spec
+    proto.figure.config = CHART_CONFIG
+    proto.theme = "streamlit"
+    return container._enqueue("plotly_chart", proto)
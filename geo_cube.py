@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import traced
+
+
+@traced('cube.build')
+def build_geo_cube(df, key_column='geo_desc'):
+    # Packs a comparison frame into a years x geographies x metrics array so every view is an index
+    # lookup. Geographies are keyed by key_column (geo_desc for states, geo_code for counties, whose
+    # names repeat); 'present' marks the (year, geography) pairs that had a row
+    metrics = [column for column in df.columns if column != 'year' and pd.api.types.is_numeric_dtype(df[column])]
+    years = np.sort(df['year'].unique())
+    geo_positions, geo_keys = pd.factorize(df[key_column].astype(str))
+    year_positions = np.searchsorted(years, df['year'].to_numpy())
+
+    values = np.full((len(years), len(geo_keys), len(metrics)), np.nan)
+    values[year_positions, geo_positions] = df[metrics].to_numpy(dtype=np.float64)
+    present = np.zeros((len(years), len(geo_keys)), dtype=bool)
+    present[year_positions, geo_positions] = True
+
+    geos = df[['geo_level', 'geo_desc', 'geo_code']].iloc[np.unique(geo_positions, return_index=True)[1]]
+    geos = geos.astype(str).reset_index(drop=True)
+    return {
+        'years': years,
+        'geos': geos,
+        'metrics': metrics,
+        'values': values,
+        'present': present,
+        'year_index': {int(year): i for i, year in enumerate(years)},
+        'geo_index': {key: i for i, key in enumerate(geo_keys)},
+        'metric_index': {metric: i for i, metric in enumerate(metrics)},
+        'level_positions': {level: np.flatnonzero(geos['geo_level'].to_numpy() == level)
+                            for level in geos['geo_level'].unique()},
+    }
+
+
+def geo_names(cube, geo_level):
+    return cube['geos']['geo_desc'].to_numpy()[cube['level_positions'].get(geo_level, [])]
+
+
+def map_slice(cube, year, metric, geo_level):
+    # Every geography of a level for one year and metric, e.g. the choropleth's data
+    year = cube['year_index'][int(year)]
+    positions = cube['level_positions'].get(geo_level, np.array([], dtype=np.int64))
+    positions = positions[cube['present'][year, positions]]
+    geos = cube['geos'].iloc[positions].reset_index(drop=True)
+    geos[metric] = cube['values'][year, positions, cube['metric_index'][metric]]
+    return geos
+
+
+def geo_year_values(cube, geo, year):
+    # One geography, every metric, one year
+    return pd.Series(cube['values'][cube['year_index'][int(year)], cube['geo_index'][geo]], index=cube['metrics'])
+
+
+def geo_history(cube, geo, metrics):
+    # One geography across every year it has data for: (years, years x metrics array)
+    geo = cube['geo_index'][geo]
+    years = cube['present'][:, geo]
+    metric_positions = [cube['metric_index'][metric] for metric in metrics]
+    return cube['years'][years], cube['values'][years, geo][:, metric_positions]
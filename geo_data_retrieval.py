@@ -1,74 +1,85 @@
-import requests
-import streamlit as st
+import re
 import pandas as pd
 import numpy as np
-
+from cms_api import fetch_frame
+from dataset_cache import CACHE_TTL, load_derived, load_processed
+from instrumentation import traced
+from schema import Column, coerce_frame, log_report, page_decoder
+
+# Dataset type identifier on the CMS data-api
+DATASET_ID = "6219697b-8f6c-4164-bed4-cd9317c58ebc"
+
+standardized_costs_dict = {
+    'total_costs': 'TOT_MDCR_STDZD_PYMT_PC',
+    'inpatient': 'IP_MDCR_STDZD_PYMT_PC',
+    'outpatient': 'OP_MDCR_STDZD_PYMT_PC',
+    'ambulatory_surgery': 'ASC_MDCR_STDZD_PYMT_PC',
+    'skilled_nursing_facility': 'SNF_MDCR_STDZD_PYMT_PC',
+    'inpatient_rehab': 'IRF_MDCR_STDZD_PYMT_PC',
+    'long_term_care_hospital': 'LTCH_MDCR_STDZD_PYMT_PC',
+    'home_health': 'HH_MDCR_STDZD_PYMT_PC',
+    'hospice': 'HOSPC_MDCR_STDZD_PYMT_PC',
+    'evaluation_management': 'EM_MDCR_STDZD_PYMT_PC',
+    'procedures': 'PRCDRS_MDCR_STDZD_PYMT_PC',
+    'tests': 'TESTS_MDCR_STDZD_PYMT_PC',
+    'imaging': 'IMGNG_MDCR_STDZD_PYMT_PC',
+    'durable_medical_equipment': 'DME_MDCR_STDZD_PYMT_PC',
+    'outpatient_dialysis': 'OP_DLYS_MDCR_STDZD_PYMT_PC',
+    'fqhc_rhc': 'FQHC_RHC_MDCR_STDZD_PYMT_PC',
+    'ambulance': 'AMBLNC_MDCR_STDZD_PYMT_PC',
+    'part_b_drugs': 'PTB_DRUGS_MDCR_STDZD_PYMT_PC',
+}
+
+additional_elements_dict = {
+    'beneficiary_count': 'BENES_WTH_PTAPTB_CNT',  # Count of Medicare beneficiaries with Part A and Part B
+    'percent_eligible_medicaid': 'BENE_DUAL_PCT',  # Percent eligible for Medicaid
+    'hospital_readmission_rate': 'ACUTE_HOSP_READMSN_PCT',  # Hospital readmission rate
+    'ed_visits_per_1000_beneficiaries': 'ER_VISITS_PER_1000_BENES',  # ED visits per 1,000 beneficiaries
+}
+
+# Source column, output name and dtype of every column process_data reads.
+# "*" marks suppressed values, replaced with 0.0001 so they're negligible
+PROCESS_SCHEMA = [
+    Column('YEAR', 'year', 'int16'),
+    Column('BENE_GEO_LVL', 'geo_level', 'category'),
+    Column('BENE_GEO_DESC', 'geo_desc', 'category'),
+    Column('BENE_GEO_CD', 'geo_code', 'str'),
+    Column('BENE_AGE_LVL', 'BENE_AGE_LVL', 'category'),
+] + [
+    Column(source, source, 'float32', '*', 0.0001) for source in standardized_costs_dict.values()
+] + [
+    # National beneficiary counts are past float32's exact integers (2**24) and feed the pct-diff columns
+    Column(source, name, 'int32' if name == 'beneficiary_count' else 'float32', '*',
+           0 if name == 'beneficiary_count' else 0.0001)
+    for name, source in additional_elements_dict.items()
+]
+
+# Only the rows and columns process_data uses are requested from the API
+QUERY_FILTERS = [
+    ('BENE_AGE_LVL', '=', 'All'),
+    ('YEAR', 'IN', ['2017', '2018', '2019', '2020', '2021']),
+]
+QUERY_COLUMNS = [column.source for column in PROCESS_SCHEMA]
+
+def filter_chunk(chunk):
+    # Row filters from process_data, applied page by page so discarded rows never accumulate
+    year = pd.to_numeric(chunk['YEAR'], errors='coerce')
+    return chunk[(year >= 2017) & (year <= 2021) & (chunk['BENE_AGE_LVL'] == 'All')]
+
+@traced('fetch.geo')
 def fetch_data():
+    # Filtered and projected server-side; filter_chunk guards against a server that ignores the query
+    return fetch_frame(DATASET_ID, QUERY_FILTERS, QUERY_COLUMNS, filter_chunk, decode=page_decoder(PROCESS_SCHEMA))
 
-    # Define the base URL and dataset type identifier
-    base_url = "https://data.cms.gov/data-api/v1/dataset"
-    dataset_type_identifier = "6219697b-8f6c-4164-bed4-cd9317c58ebc"
-
-    # Initialize variables for pagination
-    data = []
-    size = 5000  # The maximum allowed by the CMS API
-    offset = 0
-
-    while True:
-        # Construct the URL with pagination parameters
-        paginated_url = f"{base_url}/{dataset_type_identifier}/data?size={size}&offset={offset}"
-
-        # Make the GET request
-        response = requests.get(paginated_url)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            page_data = response.json()
-            # Break the loop if no data is returned
-            if not page_data:
-                break
-            # Append the data from the current page to the overall data list
-            data.extend(page_data)
-            # Update the offset to get the next page of data in the subsequent iteration
-            offset += size
-        else:
-            print("Failed to retrieve data:", response.status_code, response.text)
-            break
-    return pd.DataFrame(data)
+def load_data(ttl=CACHE_TTL):
+    return load_processed(DATASET_ID, PROCESS_SCHEMA, process_data, QUERY_FILTERS, QUERY_COLUMNS, filter_chunk, ttl)
 
+@traced('process.geo')
 def process_data(raw_df):
-    raw_df['YEAR'] = pd.to_numeric(raw_df['YEAR'], errors='coerce')
-    df = raw_df[(raw_df['YEAR'] >= 2017) & (raw_df['YEAR'] <= 2021)].reset_index(drop=True)
-    df = df[df['BENE_AGE_LVL'] == 'All'].reset_index(drop=True)
-    df['BENE_GEO_CD'] = df['BENE_GEO_CD'].astype(str)
-    non_numeric_columns = ['BENE_GEO_LVL', 'BENE_GEO_DESC', 'BENE_GEO_CD', 'BENE_AGE_LVL']
-
-    for col in df.columns:
-        if col not in non_numeric_columns:
-            # replace "*" with 0.0001 so it's negligible
-            df[col] = df[col].replace('*',0.0001)
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-    standardized_costs_dict = {
-        'total_costs': 'TOT_MDCR_STDZD_PYMT_PC',
-        'inpatient': 'IP_MDCR_STDZD_PYMT_PC',
-        'outpatient': 'OP_MDCR_STDZD_PYMT_PC',
-        'ambulatory_surgery': 'ASC_MDCR_STDZD_PYMT_PC',
-        'skilled_nursing_facility': 'SNF_MDCR_STDZD_PYMT_PC',
-        'inpatient_rehab': 'IRF_MDCR_STDZD_PYMT_PC',
-        'long_term_care_hospital': 'LTCH_MDCR_STDZD_PYMT_PC',
-        'home_health': 'HH_MDCR_STDZD_PYMT_PC',
-        'hospice': 'HOSPC_MDCR_STDZD_PYMT_PC',
-        'evaluation_management': 'EM_MDCR_STDZD_PYMT_PC',
-        'procedures': 'PRCDRS_MDCR_STDZD_PYMT_PC',
-        'tests': 'TESTS_MDCR_STDZD_PYMT_PC',
-        'imaging': 'IMGNG_MDCR_STDZD_PYMT_PC',
-        'durable_medical_equipment': 'DME_MDCR_STDZD_PYMT_PC',
-        'outpatient_dialysis': 'OP_DLYS_MDCR_STDZD_PYMT_PC',
-        'fqhc_rhc': 'FQHC_RHC_MDCR_STDZD_PYMT_PC',
-        'ambulance': 'AMBLNC_MDCR_STDZD_PYMT_PC',
-        'part_b_drugs': 'PTB_DRUGS_MDCR_STDZD_PYMT_PC',
-    }
+    df, report = coerce_frame(raw_df, PROCESS_SCHEMA)
+    log_report('Geographic variation', report)
+    df = df[(df['year'] >= 2017) & (df['year'] <= 2021) & (df['BENE_AGE_LVL'] == 'All')].reset_index(drop=True)
+
     # Combine the categories for per capita costs
     aggregated_categories_dict = {
         'total_costs_per_capita':[
@@ -107,55 +118,51 @@ def process_data(raw_df):
         ]
     }
 
-    additional_elements_dict = {
-        'beneficiary_count': 'BENES_WTH_PTAPTB_CNT',  # Count of Medicare beneficiaries with Part A and Part B
-        'percent_eligible_medicaid': 'BENE_DUAL_PCT',  # Percent eligible for Medicaid
-        'hospital_readmission_rate': 'ACUTE_HOSP_READMSN_PCT',  # Hospital readmission rate
-        'ed_visits_per_1000_beneficiaries': 'ER_VISITS_PER_1000_BENES',  # ED visits per 1,000 beneficiaries
-    }
-
     for per_capita_category, cost_columns in aggregated_categories_dict.items():
         df[per_capita_category] = df[cost_columns].sum(axis=1)
-    for new_col, existing_col in additional_elements_dict.items():
-        df[new_col] = df[existing_col].astype(float)
-
-    columns_needed = set(aggregated_categories_dict.keys())
-    columns_needed.update(additional_elements_dict.keys())
-    essential_columns = ['YEAR', 'BENE_GEO_LVL', 'BENE_GEO_DESC', 'BENE_GEO_CD']
-    columns_needed.update(essential_columns)
-    df1 = df[list(columns_needed)].copy()
-    columns_renames = {
-        'BENE_GEO_LVL': 'geo_level',
-        'BENE_GEO_DESC': 'geo_desc',
-        'BENE_GEO_CD': 'geo_code',
-        'YEAR': 'year'
-    }
-    df1 = df1.rename(columns=columns_renames)
-    dashboard_df = df1.copy()
-    dashboard_df = dashboard_df[['year', 'geo_level', 'geo_desc', 'geo_code', 'total_costs_per_capita',
-                                'inpatient_per_capita', 'ambulance_per_capita', 'post_acute_care_per_capita',
-                                'durable_medical_equipment_per_capita', 'part_b_drug_per_capita',
-                                'physician_opd_per_capita', 'hospice_per_capita', 'beneficiary_count',
-                                'percent_eligible_medicaid', 'hospital_readmission_rate', 
-                                'ed_visits_per_1000_beneficiaries']]
-    return dashboard_df
-
-def calculate_pct_diff(dashboard_df):
-    state_df = dashboard_df[dashboard_df['geo_level'].isin(['National','State'])]
-    national_df = state_df[state_df['geo_level'] == 'National']
-
-    for column in state_df.columns:
-        if state_df[column].dtype == 'float64':
-            # Merge national data for comparison based on the year
-            state_df = state_df.merge(national_df[['year', column]], on='year', suffixes=('', '_national'))
-            # Calculate percentage difference to the national value
-            state_df[f'{column}_pct_diff_to_national'] = ((state_df[column] - state_df[f'{column}_national']) / state_df[f'{column}_national']) *100
 
-    return state_df
-
-
-def get_us_state_geojson(url):
-    response = requests.get(url)
-    geo_data = response.json()
-    return geo_data
+    dashboard_df = df[['year', 'geo_level', 'geo_desc', 'geo_code', 'total_costs_per_capita',
+                       'inpatient_per_capita', 'ambulance_per_capita', 'post_acute_care_per_capita',
+                       'durable_medical_equipment_per_capita', 'part_b_drug_per_capita',
+                       'physician_opd_per_capita', 'hospice_per_capita', 'beneficiary_count',
+                       'percent_eligible_medicaid', 'hospital_readmission_rate',
+                       'ed_visits_per_1000_beneficiaries']]
+    return dashboard_df
 
+@traced('pct_diff')
+def calculate_pct_diff(dashboard_df, baseline='National', geo_levels=('National', 'State'), suffix=None):
+    # baseline is 'National' or the geo_desc of any geography (e.g. a state) to compare against
+    if suffix is None:
+        suffix = re.sub(r'\W+', '_', baseline.lower())
+    state_df = dashboard_df[dashboard_df['geo_level'].isin(geo_levels)].reset_index(drop=True)
+    if baseline == 'National':
+        baseline_df = dashboard_df[dashboard_df['geo_level'] == 'National']
+    else:
+        baseline_df = dashboard_df[dashboard_df['geo_desc'] == baseline]
+
+    metrics = [column for column in state_df.columns
+               if column != 'year' and pd.api.types.is_numeric_dtype(state_df[column])]
+    baseline_values = baseline_df.drop_duplicates('year').set_index('year')[metrics]
+
+    # Align every row to its year's baseline row once; years without a baseline are dropped
+    positions = baseline_values.index.get_indexer(state_df['year'])
+    state_df = state_df[positions >= 0].reset_index(drop=True)
+    positions = positions[positions >= 0]
+
+    values = state_df[metrics].to_numpy(dtype='float64')
+    baseline_array = baseline_values.to_numpy(dtype='float64')[positions]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_diff = (values - baseline_array) / baseline_array * 100
+
+    comparison = {}
+    for i, column in enumerate(metrics):
+        comparison[f'{column}_{suffix}'] = baseline_array[:, i]
+        comparison[f'{column}_pct_diff_to_{suffix}'] = pct_diff[:, i]
+    return pd.concat([state_df, pd.DataFrame(comparison, index=state_df.index)], axis=1)
+
+
+def load_comparison_data(geo_level='State', ttl=CACHE_TTL):
+    # calculate_pct_diff for one geography level, cached on disk; after a refresh only the years
+    # whose rows changed are recomputed
+    return load_derived(f'{DATASET_ID}-{geo_level.lower()}-vs-national', load_data(ttl), 'year',
+                        lambda df: calculate_pct_diff(df, geo_levels=('National', geo_level)))
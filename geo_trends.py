@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import traced
+
+# Time-series measures of a geo cube, computed for every geography and metric at once so the
+# dashboard's growth maps and trend rankings are lookups. Only metrics the cube compares against
+# the national baseline are covered
+
+MEASURES = {
+    'yoy': 'Year-over-year growth (%)',
+    'cagr': 'Compound annual growth (%)',
+    'rank': 'Rank',
+    'rank_change': 'Rank change',
+    'gap': 'Difference to national (%)',
+    'gap_trend': 'Difference to national trend (points per year)',
+}
+
+
+def rank_within_levels(values, level_positions):
+    # 1 = highest value among the geographies of the same level, per year and metric; NaN stays unranked
+    ranks = np.full(values.shape, np.nan)
+    for positions in level_positions.values():
+        level_values = values[:, positions]
+        order = np.argsort(-level_values, axis=1, kind='stable')
+        level_ranks = np.empty(level_values.shape)
+        np.put_along_axis(level_ranks, order, np.arange(1, len(positions) + 1)[None, :, None], axis=1)
+        ranks[:, positions] = np.where(np.isnan(level_values), np.nan, level_ranks)
+    return ranks
+
+
+def trend_slope(years, values):
+    # Least-squares slope along the year axis, skipping missing years; NaN with fewer than two
+    present = ~np.isnan(values)
+    counts = present.sum(axis=0)
+    x = np.where(present, years[:, None, None], 0.0)
+    y = np.where(present, values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx = np.where(present, x - x.sum(axis=0) / counts, 0.0)
+        dy = np.where(present, y - y.sum(axis=0) / counts, 0.0)
+        slope = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+    return np.where(counts >= 2, slope, np.nan)
+
+
+@traced('trends.build')
+def build_geo_trends(cube):
+    # Arrays are years x geographies x metrics, or geographies x metrics for whole-period measures,
+    # along the cube's geography axis. CAGR and rank change run from the first to the last year
+    metrics = [metric for metric in cube['metrics'] if f'{metric}_pct_diff_to_national' in cube['metric_index']]
+    positions = [cube['metric_index'][metric] for metric in metrics]
+    gap_positions = [cube['metric_index'][f'{metric}_pct_diff_to_national'] for metric in metrics]
+    present = cube['present'][:, :, None]
+    values = np.where(present, cube['values'][:, :, positions], np.nan)
+    gaps = np.where(present, cube['values'][:, :, gap_positions], np.nan)
+    years = np.asarray(cube['years'], dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yoy = np.full(values.shape, np.nan)
+        yoy[1:] = np.where(values[:-1] > 0, (values[1:] / values[:-1] - 1) * 100, np.nan)
+        first, last = values[0], values[-1]
+        cagr = np.where((first > 0) & (last >= 0), ((last / first) ** (1 / (years[-1] - years[0])) - 1) * 100, np.nan)
+    ranks = rank_within_levels(values, cube['level_positions'])
+    return {
+        'metrics': metrics,
+        'metric_index': {metric: i for i, metric in enumerate(metrics)},
+        'yoy': yoy,
+        'cagr': cagr,
+        'rank': ranks,
+        # Positive means the geography moved up the ranking
+        'rank_change': ranks[0] - ranks[-1],
+        'gap': gaps,
+        'gap_trend': trend_slope(years, gaps),
+    }
+
+
+def trend_values(cube, trends, measure, metric, year=None):
+    # One measure of one metric for every geography; yearly measures need a year
+    values = trends[measure]
+    if values.ndim == 3:
+        values = values[cube['year_index'][int(year)]]
+    return values[:, trends['metric_index'][metric]]
+
+
+def trend_slice(cube, trends, measure, metric, geo_level, year=None):
+    # Like geo_cube.map_slice, with the measure in a column named after it, e.g. for a growth map
+    positions = cube['level_positions'].get(geo_level, np.array([], dtype=np.int64))
+    values = trend_values(cube, trends, measure, metric, year)[positions]
+    geos = cube['geos'].iloc[positions].reset_index(drop=True)
+    geos[MEASURES[measure]] = values
+    return geos[~np.isnan(values)].reset_index(drop=True)
+
+
+def trend_ranking(cube, trends, metric, geo_level):
+    # Every geography of a level with its growth, rank movement and national gap trend for one
+    # metric, fastest growing first
+    positions = cube['level_positions'].get(geo_level, np.array([], dtype=np.int64))
+    first_year, last_year = int(cube['years'][0]), int(cube['years'][-1])
+    ranking = pd.DataFrame({
+        'Geography': cube['geos']['geo_desc'].to_numpy()[positions],
+        f'Growth {first_year}-{last_year} (CAGR %)': trend_values(cube, trends, 'cagr', metric)[positions],
+        f'Growth {last_year - 1}-{last_year} (%)': trend_values(cube, trends, 'yoy', metric, last_year)[positions],
+        f'Rank {first_year}': trend_values(cube, trends, 'rank', metric, first_year)[positions],
+        f'Rank {last_year}': trend_values(cube, trends, 'rank', metric, last_year)[positions],
+        'Rank Change': trend_values(cube, trends, 'rank_change', metric)[positions],
+        f'Difference to National {last_year} (%)': trend_values(cube, trends, 'gap', metric, last_year)[positions],
+        'Difference to National Trend (points/year)': trend_values(cube, trends, 'gap_trend', metric)[positions],
+    })
+    return ranking.sort_values(ranking.columns[1], ascending=False, na_position='last').reset_index(drop=True)
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from geo_cube import geo_history, geo_year_values
+from instrumentation import traced
+
+# Figures and tables of the geographic variation dashboard, built from the comparison cubes
+
+
+@traced('figure.map')
+def create_map_chart(yearly_map_data, map_geojson, map_locations, map_featureidkey, selected_cost, map_level, selected_year,
+                     title=None):
+    # Choropleth map for the selected year and cost metric; selected_cost is the column to color by
+    # Plotly is imported on first use so table-only callers never load it
+    import plotly.express as px
+
+    fig = px.choropleth(
+        yearly_map_data,
+        geojson=map_geojson,
+        locations=map_locations,
+        featureidkey=map_featureidkey,
+        color=selected_cost,
+        scope='usa',
+        hover_data={
+            map_locations: False,
+            selected_cost: ':.2f'
+        },
+        hover_name='geo_desc',
+        title=title or f"{selected_cost} cost by {map_level} in {selected_year}",
+        color_continuous_scale=px.colors.sequential.Sunset
+    )
+
+    fig.update_layout(width=800, height=600,
+                      legend_title_text='Cost per Capita ($)',
+                      legend=dict(
+                          orientation='h',
+                          yanchor='bottom',
+                          y=-0.5,
+                          xanchor='center',
+                          x=0.5
+                      )
+                    )
+    return fig
+
+
+@traced('figure.breakdown_table')
+def create_cost_breakdown_chart(state_cube, selected_year, selected_state):
+    national_data = geo_year_values(state_cube, 'National', selected_year)
+    state_data = geo_year_values(state_cube, selected_state, selected_year)
+    cost_columns = ['total_costs_per_capita', 'inpatient_per_capita', 'ambulance_per_capita',
+                    'post_acute_care_per_capita', 'durable_medical_equipment_per_capita',
+                    'part_b_drug_per_capita', 'physician_opd_per_capita', 'hospice_per_capita']
+
+    chart_df = pd.DataFrame({
+        'Cost':['Total','Inpatient','Ambulance','Post Acute Care','Durable Medical Equipment','Part B Drugs','Physician OPD','Hospice'],
+        'State': state_data[cost_columns].to_numpy(),
+        'Nation': national_data[cost_columns].to_numpy(),
+        '% Diff to Nation': state_data[[f'{column}_pct_diff_to_national' for column in cost_columns]].to_numpy()
+    })
+    return chart_df.round(2)
+
+
+@traced('figure.state_details')
+def create_state_details_table(state_cube, selected_year, selected_state):
+    state_info = geo_year_values(state_cube, selected_state, selected_year)
+    state_details = {
+        'Beneficiary Count': state_info['beneficiary_count'],
+        '% Eligible for Medicaid': state_info['percent_eligible_medicaid']*100,
+        'Hospital Readmission Rate (%)': state_info['hospital_readmission_rate']*100,
+        'ED Visits per 1000 Beneficiaries': state_info['ed_visits_per_1000_beneficiaries']
+    }
+    state_details_df = pd.DataFrame(state_details.items(), columns=['Metric', 'Value'])
+    state_details_df.set_index('Metric', inplace=True)
+    state_details_df = state_details_df.round(2)
+
+    # Convert numerical columns to strings to enforce the two decimal place format in Streamlit's table display.
+    return state_details_df.map(lambda x: f"{x:.2f}" if isinstance(x, (int, float)) else x)
+
+
+@traced('figure.multi_year')
+def create_multi_year_cost_chart(state_cube, selected_state):
+    cost_types = [
+        'total_costs_per_capita', 'inpatient_per_capita', 'ambulance_per_capita',
+        'post_acute_care_per_capita', 'durable_medical_equipment_per_capita',
+        'part_b_drug_per_capita', 'physician_opd_per_capita', 'hospice_per_capita'
+    ]
+    years, values = geo_history(state_cube, selected_state, cost_types)
+    # Same long layout melt produced: every year of the first cost type, then the next
+    plot_data = pd.DataFrame({
+        'year': np.tile(years, len(cost_types)),
+        'Cost Type': np.repeat(cost_types, len(years)),
+        'Cost Per Capita': values.T.ravel(),
+    })
+
+    import plotly.express as px
+
+    fig = px.line(
+        plot_data,
+        x='year',
+        y='Cost Per Capita',
+        color='Cost Type',
+        title=f"Annual Cost Breakdown Per Capita for {selected_state}",
+        labels={'Cost Per Capita': 'Cost Per Capita ($)', 'year': 'Year'},
+        markers=True
+    )
+    fig.update_layout(
+        xaxis_title='Year',
+        yaxis_title='Cost Per Capita ($)',
+        legend_title='Cost Type',
+        legend=dict(orientation='h', yanchor='bottom', y=-0.5, xanchor='center', x=0.5)
+    )
+    return fig
@@ -0,0 +1,240 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+GEOMETRY_CACHE_DIR = os.environ.get("IHI_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+# Coordinates are snapped to a QUANTIZATION x QUANTIZATION grid over the bounding box
+QUANTIZATION = 1000000
+# Douglas-Peucker tolerance in degrees and output decimal places for each detail level
+DETAIL_LEVELS = {
+    "high": {"tolerance": 0.002, "precision": 4},
+    "medium": {"tolerance": 0.01, "precision": 3},
+    "low": {"tolerance": 0.05, "precision": 2},
+}
+
+
+def iter_polygons(geometry):
+    if geometry["type"] == "Polygon":
+        yield geometry["coordinates"]
+    elif geometry["type"] == "MultiPolygon":
+        yield from geometry["coordinates"]
+
+
+def quantize_rings(geojson):
+    points = np.array([point[:2] for feature in geojson["features"]
+                       for polygon in iter_polygons(feature["geometry"])
+                       for ring in polygon for point in ring])
+    origin = points.min(axis=0)
+    scale = (points.max(axis=0) - origin) / (QUANTIZATION - 1)
+
+    features = []
+    for feature in geojson["features"]:
+        polygons = []
+        for polygon in iter_polygons(feature["geometry"]):
+            rings = []
+            for ring in polygon:
+                grid = np.round((np.array(ring)[:, :2] - origin) / scale).astype(np.int64)
+                # Drop points that collapse onto their predecessor after snapping
+                keep = np.ones(len(grid), dtype=bool)
+                keep[1:] = np.any(grid[1:] != grid[:-1], axis=1)
+                grid = [tuple(point) for point in grid[keep].tolist()]
+                if len(grid) >= 4 and grid[0] == grid[-1]:
+                    rings.append(grid[:-1])
+            if rings:
+                polygons.append(rings)
+        features.append(polygons)
+    return features, {"scale": scale.tolist(), "translate": origin.tolist()}
+
+
+def find_junctions(features):
+    # A point is a junction where boundaries shared by neighbouring rings start or end,
+    # i.e. it has more than two distinct neighbours across every ring it appears in
+    neighbours = {}
+    for polygons in features:
+        for rings in polygons:
+            for ring in rings:
+                count = len(ring)
+                for i, point in enumerate(ring):
+                    entry = neighbours.setdefault(point, set())
+                    entry.add(ring[i - 1])
+                    entry.add(ring[(i + 1) % count])
+    return {point for point, entry in neighbours.items() if len(entry) > 2}
+
+
+def cut_ring(ring, junctions):
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        # Unshared ring: start it at its smallest point so an identical ring elsewhere dedupes
+        start = ring.index(min(ring))
+        rotated = ring[start:] + ring[:start]
+        return [rotated + [rotated[0]]]
+    rotated = ring[cuts[0]:] + ring[:cuts[0]]
+    offsets = [i - cuts[0] for i in cuts] + [len(ring)]
+    rotated = rotated + [rotated[0]]
+    return [rotated[start:end + 1] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def build_topology(geojson, id_property):
+    # TopoJSON-style topology: each shared boundary is stored once as an arc and referenced by
+    # index from both sides (~index when traversed backwards)
+    features, transform = quantize_rings(geojson)
+    junctions = find_junctions(features)
+    arcs, arc_index = [], {}
+
+    def arc_ref(arc):
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        reverse_key = key[::-1]
+        if reverse_key in arc_index:
+            return ~arc_index[reverse_key]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return arc_index[key]
+
+    objects = {}
+    for feature, polygons in zip(geojson["features"], features):
+        objects[str(feature["properties"][id_property])] = [
+            [[arc_ref(arc) for arc in cut_ring(ring, junctions)] for ring in rings]
+            for rings in polygons
+        ]
+    return {"transform": transform, "arcs": [np.array(arc).tolist() for arc in arcs], "objects": objects}
+
+
+def douglas_peucker(points, tolerance):
+    # Returns the indices of points kept; the endpoints are always kept so shared arcs still meet
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_topology(topology, tolerance):
+    # Tolerance is in degrees; converted to grid units using the coarser axis scale
+    grid_tolerance = tolerance / max(topology["transform"]["scale"])
+    simplified = []
+    for arc in topology["arcs"]:
+        points = np.array(arc, dtype=np.float64)
+        simplified.append(points[douglas_peucker(points, grid_tolerance)].astype(np.int64).tolist())
+    return simplified
+
+
+def build_detail_levels(topology):
+    return {level: simplify_topology(topology, settings["tolerance"]) for level, settings in DETAIL_LEVELS.items()}
+
+
+def topology_cache_path(name):
+    return os.path.join(GEOMETRY_CACHE_DIR, f"{name}.topo.json")
+
+
+def load_topology(name, id_property):
+    # The topology and its simplified detail levels are built once and kept next to the dataset cache.
+    # Threads asking for different detail levels on a cold cache wait for the first one's build, and
+    # the file is written through a temp name of its own so other processes never see it half-written
+    from dataset_cache import key_lock, replace_file
+
+    source_path = os.path.join(DATA_DIR, f"{name}.geojson")
+    cache_path = topology_cache_path(name)
+    with key_lock(f"{name}.topo"):
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(source_path):
+            with open(cache_path) as f:
+                return json.load(f)
+
+        with open(source_path) as f:
+            geojson = json.load(f)
+        topology = build_topology(geojson, id_property)
+        topology["levels"] = build_detail_levels(topology)
+        del topology["arcs"]
+
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(topology, f, separators=(",", ":"))
+
+        os.makedirs(GEOMETRY_CACHE_DIR, exist_ok=True)
+        replace_file(cache_path, write)
+        return topology
+
+
+def ring_coordinates(arc_refs, arcs, transform, precision):
+    points = []
+    for ref in arc_refs:
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        # Consecutive arcs share their junction point
+        points.extend(arc if not points else arc[1:])
+    if len(points) < 4:
+        return None
+    coordinates = np.array(points, dtype=np.float64) * transform["scale"] + transform["translate"]
+    return np.round(coordinates, precision).tolist()
+
+
+def topology_to_geojson(topology, level):
+    arcs, transform = topology["levels"][level], topology["transform"]
+    precision = DETAIL_LEVELS[level]["precision"]
+    features = []
+    for feature_id, polygons in topology["objects"].items():
+        coordinates = []
+        for rings in polygons:
+            exterior = ring_coordinates(rings[0], arcs, transform, precision)
+            if exterior is None:
+                # Tiny polygons that collapse at this level keep their most detailed outline
+                exterior = ring_coordinates(rings[0], topology["levels"]["high"], transform, precision)
+            if exterior is None:
+                continue
+            holes = [ring_coordinates(ring, arcs, transform, precision) for ring in rings[1:]]
+            coordinates.append([exterior] + [hole for hole in holes if hole is not None])
+        if coordinates:
+            features.append({"type": "Feature", "id": feature_id, "properties": {},
+                             "geometry": {"type": "MultiPolygon", "coordinates": coordinates}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def round_geometry(geometry, precision):
+    polygons = [[np.round(np.array(ring)[:, :2], precision).tolist() for ring in polygon]
+                for polygon in iter_polygons(geometry)]
+    if geometry["type"] == "Polygon":
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+@lru_cache(maxsize=None)
+def load_boundaries(name, properties=(), precision=4):
+    # Bundled boundary files are parsed once per process and the same object is shared by every session;
+    # only the listed feature properties are kept
+    with open(os.path.join(DATA_DIR, f"{name}.geojson")) as f:
+        geojson = json.load(f)
+    features = [{"type": "Feature",
+                 "properties": {key: feature["properties"][key] for key in properties},
+                 "geometry": round_geometry(feature["geometry"], precision)}
+                for feature in geojson["features"]]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def get_us_state_geojson():
+    # States are matched on their postal abbreviation in properties.STUSPS
+    return load_boundaries("us_states", ("STUSPS",))
+
+
+@lru_cache(maxsize=None)
+def get_us_county_geojson(level="medium"):
+    # Counties keyed by 5-digit FIPS code in the feature id, simplified for the given detail level
+    return topology_to_geojson(load_topology("us_counties", "GEOID"), level)
@@ -0,0 +1,198 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+
+try:
+    import psutil
+except ImportError:  # Optional; without it RSS is read from /proc where there is one
+    psutil = None
+
+# Per-stage spans for the data pipeline and dashboards. Turned on with IHI_TRACE=1; every finished
+# span is logged as one JSON line on the "instrumentation" logger and kept in a bounded buffer that
+# the dashboards' debug panel reads. When tracing is off span() hands back a shared no-op object,
+# so instrumented code pays a single flag check.
+# Spans carry the trace of the thread that recorded them, e.g. one dashboard script run, so the
+# panel only shows its own run's stages when several sessions share the process
+ENABLED = os.environ.get("IHI_TRACE", "").lower() in ("1", "true", "yes")
+MAX_SPANS = 5000
+
+logger = logging.getLogger(__name__)
+_spans = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+_open_spans = set()
+_peak_lock = threading.Lock()
+
+if ENABLED and not logger.handlers:
+    # Spans are written to stderr unless the application has set up this logger itself
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+if ENABLED:
+    # Peak memory per stage comes from tracemalloc, which sees Python and NumPy allocations (so pandas
+    # columns) but not Arrow's memory pool. It slows allocation-heavy code down, so only while tracing
+    tracemalloc.start()
+
+
+def rss_mb():
+    # Current resident set size of the process; None where it cannot be read
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def fold_peak():
+    # tracemalloc keeps a single process-wide peak, so it is folded into every open span and reset;
+    # each span ends up with the highest traced memory reached while it was open. Call with _peak_lock
+    _, peak = tracemalloc.get_traced_memory()
+    for open_span in _open_spans:
+        open_span.peak = max(open_span.peak, peak)
+    tracemalloc.reset_peak()
+
+
+def start_trace():
+    # Starts a new trace on the calling thread and returns its id
+    trace_id = uuid.uuid4().hex[:12]
+    _local.trace = trace_id
+    return trace_id
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def set_trace(trace_id):
+    _local.trace = trace_id
+
+
+def carry_trace(func):
+    # Wraps func so its spans join the calling thread's trace when it runs in a worker thread
+    trace_id = current_trace()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current_trace()
+        set_trace(trace_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            set_trace(previous)
+    return wrapper
+
+
+def rows_of(value):
+    # Row count of DataFrames, arrays and lists; None for anything else
+    if hasattr(value, "shape"):
+        return value.shape[0] if value.shape else None
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+
+class Span:
+    def __init__(self, name, fields):
+        self.name, self.fields = name, fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.rss_before = rss_mb()
+        with _peak_lock:
+            fold_peak()
+            self.traced_before = self.peak = tracemalloc.get_traced_memory()[0]
+            _open_spans.add(self)
+        self.started_at, self.start = time.time(), time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        _local.stack.pop()
+        with _peak_lock:
+            fold_peak()
+            _open_spans.discard(self)
+        rss_after = rss_mb()
+        # Memory is process-wide, so stages running at the same time in other threads add to each other's
+        # figures. peak_mb is the most memory allocated above the stage's starting point while it ran, even
+        # if it was freed again before the end
+        rss = ({"rss_mb": round(rss_after, 1), "rss_delta_mb": round(rss_after - self.rss_before, 1)}
+               if rss_after is not None and self.rss_before is not None else {})
+        record = {"span": self.name, "started_at": self.started_at, "duration_ms": round(duration_ms, 3),
+                  "parent": self.parent, "depth": self.depth, "thread": threading.current_thread().name,
+                  "trace": current_trace(), "peak_mb": round((self.peak - self.traced_before) / 2 ** 20, 1),
+                  **rss, **self.fields}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _spans.append(record)
+        logger.info(json.dumps(record, default=str))
+        return False
+
+
+class NullSpan:
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **fields):
+    return Span(name, fields) if ENABLED else NULL_SPAN
+
+
+def traced(name):
+    # Decorator form of span(); records rows in (first argument) and out (return value) when they have rows
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Span(name, {}) as current:
+                if args and rows_of(args[0]) is not None:
+                    current.set(rows_in=rows_of(args[0]))
+                result = func(*args, **kwargs)
+                if rows_of(result) is not None:
+                    current.set(rows_out=rows_of(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def recent_spans(since=None, trace=None):
+    return [record for record in list(_spans) if (since is None or record["started_at"] >= since)
+            and (trace is None or record["trace"] == trace)]
+
+
+def summarize(spans):
+    # Totals per span name, slowest first
+    totals = {}
+    for record in spans:
+        total = totals.setdefault(record["span"], {"span": record["span"], "count": 0, "total_ms": 0.0, "bytes": 0,
+                                                   "peak_mb": 0.0})
+        total["count"] += 1
+        total["total_ms"] += record["duration_ms"]
+        total["bytes"] += record.get("bytes") or 0
+        total["peak_mb"] = max(total["peak_mb"], record.get("peak_mb") or 0.0)
+    return sorted(totals.values(), key=lambda total: -total["total_ms"])
@@ -0,0 +1,35 @@
+import streamlit as st
+
+from sort_orders import PAGE_SIZE, page_count, page_window, table_rows
+
+
+def frame_page(df):
+    # page_frame for a frame with a RangeIndex: only the page's cells are copied, so a memory-mapped
+    # frame stays on disk
+    return lambda rows, columns: df.iloc[rows, df.columns.get_indexer(columns)]
+
+
+def show_paged_table(row_count, page_frame, columns, orders, rows=None, key='table', page_size=PAGE_SIZE):
+    # Sorting and paging happen here over the precomputed sort orders, so only the visible page of
+    # columns is built and serialized to the browser on each rerun. page_frame(rows, columns) returns
+    # the table's DataFrame for those row positions, e.g. frame_page(df); rows limits the table to a
+    # subset
+    sort_control, direction_control, page_control = st.columns([3, 1, 1])
+    sort_column = sort_control.selectbox("Sort by", [None, *[column for column in columns if column in orders]],
+                                         format_func=lambda column: "Default order" if column is None else column,
+                                         key=f'{key}_sort')
+    descending = direction_control.toggle("Descending", value=True, key=f'{key}_descending',
+                                          disabled=sort_column is None)
+    ordered = table_rows(orders, row_count, rows, sort_column, descending)
+
+    # The page count is part of the label, so a search or filter that changes it starts again at page 1
+    pages = page_count(len(ordered), page_size)
+    page = page_control.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f'{key}_page')
+    window, page = page_window(ordered, page, page_size)
+
+    st.dataframe(page_frame(window, columns))
+    if len(ordered):
+        start = (page - 1) * page_size
+        st.caption(f"Rows {start + 1}-{start + len(window)} of {len(ordered)}")
+    else:
+        st.caption("No matching rows")
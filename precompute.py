@@ -0,0 +1,143 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from artifacts import (ARTIFACT_DIR, CURRENT_FILE, current_version, publish, read_manifest, write_cube, write_json,
+                       write_lookup, write_pickle, write_table)
+
+# Offline build of everything the dashboards read at startup: fetch -> process -> derive for each
+# dataset in its own process, written to a fresh version directory that is only published if every
+# job succeeds. Run it on a schedule (or after CMS publishes) so dashboards start from artifacts:
+#   python precompute.py [--jobs geo drugs_b drugs_d geometry] [--workers 4]
+
+logger = logging.getLogger(__name__)
+
+
+def build_geo(directory):
+    from geo_data_retrieval import DATASET_ID, load_comparison_data, load_data
+    from dataset_cache import cached_version
+    from geo_cube import build_geo_cube
+
+    # Each build revalidates its dataset against CMS instead of trusting a cache younger than the TTL;
+    # the comparison frames then derive from the frame that was just checked
+    dashboard_df = load_data(ttl=0)
+    write_table(directory, "dashboard", dashboard_df)
+    rows = {"dashboard": len(dashboard_df)}
+    for geo_level in ("State", "County"):
+        comparison_df = load_comparison_data(geo_level)
+        if geo_level == "County":
+            comparison_df["geo_code"] = comparison_df["geo_code"].str.zfill(5)
+        name = geo_level.lower()
+        write_table(directory, name, comparison_df)
+        rows[name] = len(comparison_df)
+        # Counties are keyed by FIPS code since their names repeat across states
+        write_cube(directory, f"{name}_cube", build_geo_cube(comparison_df, "geo_code" if geo_level == "County" else "geo_desc"))
+    return {"dataset_version": cached_version(DATASET_ID), "rows": rows}
+
+
+def build_drugs_b(directory):
+    from drugs_b_data_retrieval import DATASET_ID, load_data
+    from dataset_cache import cached_version
+    from drug_search import build_drug_lookup
+    from sort_orders import build_sort_orders
+
+    processed_df = load_data(ttl=0)
+    write_table(directory, "processed", processed_df)
+    write_lookup(directory, "lookup", build_drug_lookup(processed_df))
+    write_pickle(directory, "sort_orders", build_sort_orders(processed_df))
+    return {"dataset_version": cached_version(DATASET_ID), "rows": {"processed": len(processed_df)}}
+
+
+def build_drugs_d(directory):
+    from drugs_d_data_retrieval import DATASET_ID, load_data
+    from dataset_cache import cached_version
+    from drug_search import build_drug_lookup, build_search_index
+    from sort_orders import build_sort_orders
+
+    processed_df = load_data(ttl=0)
+    write_table(directory, "processed", processed_df)
+    write_pickle(directory, "search_index", build_search_index(processed_df))
+    write_lookup(directory, "lookup", build_drug_lookup(processed_df))
+    write_pickle(directory, "sort_orders", build_sort_orders(processed_df))
+    return {"dataset_version": cached_version(DATASET_ID), "rows": {"processed": len(processed_df)}}
+
+
+def build_geometry(directory):
+    from geometry import DETAIL_LEVELS, get_us_county_geojson, get_us_state_geojson
+
+    write_json(directory, "us_states", get_us_state_geojson())
+    for level in DETAIL_LEVELS:
+        write_json(directory, f"us_counties_{level}", get_us_county_geojson(level))
+    return {"levels": list(DETAIL_LEVELS)}
+
+
+JOBS = {
+    "geo": build_geo,
+    "drugs_b": build_drugs_b,
+    "drugs_d": build_drugs_d,
+    "geometry": build_geometry,
+}
+
+
+def run_job(name, build_dir):
+    directory = os.path.join(build_dir, name)
+    os.makedirs(directory)
+    start = time.perf_counter()
+    summary = JOBS[name](directory)
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def prune_versions(keep):
+    # Older complete versions are kept for rollback; unfinished build directories are left to their owners
+    current = current_version()
+    versions = sorted(entry for entry in os.listdir(ARTIFACT_DIR)
+                      if entry != current and entry != CURRENT_FILE and not entry.startswith("."))
+    for version in versions[:max(len(versions) - (keep - 1), 0)]:
+        shutil.rmtree(os.path.join(ARTIFACT_DIR, version), ignore_errors=True)
+
+
+def precompute(jobs=tuple(JOBS), workers=None, keep=2):
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    build_dir = os.path.join(ARTIFACT_DIR, f".{version}.{os.getpid()}.tmp")
+    os.makedirs(build_dir)
+    manifest = {"version": version, "jobs": {}}
+    try:
+        with ProcessPoolExecutor(max_workers=workers or len(jobs)) as executor:
+            futures = {executor.submit(run_job, name, build_dir): name for name in jobs}
+            for future in as_completed(futures):
+                name = futures[future]
+                manifest["jobs"][name] = future.result()
+                logger.info("%s built in %ss", name, manifest["jobs"][name]["seconds"])
+        # Jobs missing from this run are carried over from the current version so it stays complete
+        previous = current_version()
+        previous_manifest = read_manifest(previous) if previous else {"jobs": {}}
+        for name in set(JOBS) - set(jobs):
+            if name in previous_manifest["jobs"]:
+                shutil.copytree(os.path.join(ARTIFACT_DIR, previous, name), os.path.join(build_dir, name))
+                manifest["jobs"][name] = dict(previous_manifest["jobs"][name], carried_from=previous)
+        publish(build_dir, version, manifest)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    prune_versions(keep)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dashboards' precomputed artifacts")
+    parser.add_argument("--jobs", nargs="+", choices=list(JOBS), default=list(JOBS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--keep", type=int, default=2, help="published versions to keep, including the new one")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        manifest = precompute(args.jobs, args.workers, args.keep)
+    except Exception:
+        logger.exception("Precompute failed; the published artifacts were left unchanged")
+        sys.exit(1)
+    print(f"Published artifacts {manifest['version']} to {ARTIFACT_DIR}")
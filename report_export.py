@@ -0,0 +1,153 @@
+import argparse
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+from geo_cube import geo_names
+from geo_views import create_cost_breakdown_chart, create_multi_year_cost_chart, create_state_details_table
+
+# Headless export of the geographic variation dashboard's per-state views: for every state the
+# cost breakdown and details tables of each year and the multi-year cost chart, built by the same
+# functions the dashboard uses. States are spread over a process pool; the workers memory-map one
+# read-only copy of the state cube instead of each receiving the data.
+#   python report_export.py --output reports [--tables csv|parquet] [--figures html|json] [--states CA NY]
+
+logger = logging.getLogger(__name__)
+
+TABLE_FORMATS = ("csv", "parquet")
+FIGURE_FORMATS = ("html", "json")
+
+_cube = None
+
+
+def load_state_cube():
+    # The published artifact when there is one, otherwise built from the cached dataset
+    cube = artifacts.load_cube("geo", "state_cube")
+    if cube is None:
+        from geo_data_retrieval import load_comparison_data
+        from geo_cube import build_geo_cube
+
+        cube = build_geo_cube(load_comparison_data("State"), "geo_desc")
+    return cube
+
+
+def share_cube(cube, directory):
+    # Where the workers can memory-map the cube's values from: the published artifact itself, or a
+    # copy written to directory. The rest of the cube is small and pickled to each worker once
+    if isinstance(cube["values"], np.memmap):
+        return dict(cube, values=None), cube["values"].filename
+    values_path = os.path.join(directory, "state_cube_values.npy")
+    np.save(values_path, np.asarray(cube["values"]))
+    return dict(cube, values=None), values_path
+
+
+def init_worker(cube, values_path):
+    global _cube
+    _cube = dict(cube, values=np.load(values_path, mmap_mode="r"))
+
+
+def file_name(text):
+    return re.sub(r"[^\w.-]+", "_", str(text)).strip("_")
+
+
+def write_table(df, path, table_format):
+    if table_format == "parquet":
+        # Parquet needs string column names and keeps the index as a column
+        df.reset_index().to_parquet(f"{path}.parquet", index=False)
+    else:
+        df.to_csv(f"{path}.csv")
+
+
+def write_figure(fig, path, figure_format):
+    if figure_format == "json":
+        fig.write_json(f"{path}.json")
+    else:
+        # plotly.js comes from the CDN so each report stays small
+        fig.write_html(f"{path}.html", include_plotlyjs="cdn")
+
+
+def export_state(state, years, output_dir, table_formats, figure_formats):
+    # Runs in a worker; returns one index row per file written
+    state_dir = os.path.join(output_dir, file_name(state))
+    os.makedirs(state_dir, exist_ok=True)
+    written = []
+    for year in years:
+        tables = {
+            "cost_breakdown": create_cost_breakdown_chart(_cube, year, state).set_index("Cost"),
+            "state_details": create_state_details_table(_cube, year, state),
+        }
+        for name, df in tables.items():
+            for table_format in table_formats:
+                path = os.path.join(state_dir, f"{name}_{year}")
+                write_table(df, path, table_format)
+                written.append({"state": state, "year": year, "report": name, "path": f"{path}.{table_format}"})
+    fig = create_multi_year_cost_chart(_cube, state)
+    for figure_format in figure_formats:
+        path = os.path.join(state_dir, "multi_year_cost")
+        write_figure(fig, path, figure_format)
+        written.append({"state": state, "year": None, "report": "multi_year_cost", "path": f"{path}.{figure_format}"})
+    return written
+
+
+def export_reports(output_dir, states=None, years=None, table_formats=("csv",), figure_formats=("html",),
+                   workers=None):
+    cube = load_state_cube()
+    states = list(states) if states else sorted(geo_names(cube, "State"))
+    years = [int(year) for year in years] if years else [int(year) for year in cube["years"]]
+    unknown = sorted(set(states) - set(cube["geo_index"]))
+    if unknown:
+        raise ValueError(f"Unknown states: {', '.join(unknown)}")
+    missing_years = sorted(set(years) - set(cube["year_index"]))
+    if missing_years:
+        raise ValueError(f"No data for years: {', '.join(map(str, missing_years))}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    share_dir = tempfile.mkdtemp(prefix="ihi-report-export-")
+    written = []
+    try:
+        small_cube, values_path = share_cube(cube, share_dir)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(small_cube, values_path)) as executor:
+            futures = {executor.submit(export_state, state, years, output_dir, table_formats, figure_formats): state
+                       for state in states}
+            for future in as_completed(futures):
+                written.extend(future.result())
+    finally:
+        shutil.rmtree(share_dir, ignore_errors=True)
+
+    index = pd.DataFrame(written, columns=["state", "year", "report", "path"]).astype({"year": "Int64"})
+    index = index.sort_values(["state", "report", "year"])
+    index.to_csv(os.path.join(output_dir, "index.csv"), index=False)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the geo dashboard's per-state reports for every state and year")
+    parser.add_argument("--output", required=True, help="directory to write the reports to")
+    parser.add_argument("--states", nargs="+", default=None, help="state names as shown in the dashboard (default: all)")
+    parser.add_argument("--years", nargs="+", default=None, help="default: every year in the data")
+    parser.add_argument("--tables", nargs="+", choices=TABLE_FORMATS, default=["csv"])
+    parser.add_argument("--figures", nargs="+", choices=FIGURE_FORMATS, default=["html"])
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    start = time.perf_counter()
+    try:
+        index = export_reports(args.output, args.states, args.years, args.tables, args.figures, args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+    except Exception:
+        logger.exception("Report export failed")
+        sys.exit(1)
+    print(f"Wrote {len(index)} files for {index['state'].nunique()} states to {args.output} "
+          f"in {time.perf_counter() - start:.1f}s")
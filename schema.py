@@ -0,0 +1,136 @@
+import functools
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# One entry per output column: source name in the CMS data, output name, output dtype
+# ('str', 'category' or a numpy dtype), an optional suppression sentinel and the value it stands
+# for, and the number of decimals to round to
+Column = namedtuple('Column', ['source', 'name', 'dtype', 'sentinel', 'sentinel_value', 'decimals'],
+                    defaults=[None, None, None])
+
+
+def yearly_columns(metrics, years, **options):
+    # metrics are (source prefix, output prefix, dtype); columns are ordered year by year like the CMS data
+    return [Column(f'{source}_{year}', f'{name} {year}', dtype, **options)
+            for year in years for source, name, dtype in metrics]
+
+
+def parse_numeric(values, column):
+    # values is a 2-D object array of raw CMS strings, one row per column sharing column's sentinel.
+    # Returns float64 values of the same shape, with blanks, nulls and anything unparseable as NaN and
+    # the sentinel as its sentinel_value, and one counts dict per row. Arrow's string cast parses the
+    # whole block in one call; blocks with values it rejects (e.g. padded or non-string ones) go through pandas
+    shape, values = values.shape, values.ravel()
+    try:
+        strings = pa.array(values, type=pa.string(), from_pandas=True)
+        missing = pc.fill_null(pc.equal(strings, ''), True)
+        skip = missing
+        if column.sentinel is not None:
+            suppressed = pc.fill_null(pc.equal(strings, column.sentinel), False)
+            skip = pc.or_(missing, suppressed)
+        numeric = pc.cast(pc.if_else(skip, pa.scalar(None, pa.string()), strings), pa.float64())
+        numeric = numeric.to_numpy(zero_copy_only=False, writable=True)
+        missing = missing.to_numpy(zero_copy_only=False)
+        suppressed = suppressed.to_numpy(zero_copy_only=False) if column.sentinel is not None else np.zeros(len(values), bool)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        raw = pd.Series(values, dtype=object)
+        missing = (raw.isna() | (raw == '')).to_numpy()
+        suppressed = (raw == column.sentinel).to_numpy() if column.sentinel is not None else np.zeros(len(raw), bool)
+        numeric = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64, copy=True)
+    numeric, missing, suppressed = numeric.reshape(shape), missing.reshape(shape), suppressed.reshape(shape)
+    coerced = np.isnan(numeric) & ~missing & ~suppressed
+    counts = [{'missing': int(m), 'suppressed': int(s), 'coerced': int(c)}
+              for m, s, c in zip(missing.sum(axis=1), suppressed.sum(axis=1), coerced.sum(axis=1))]
+    numeric[suppressed] = np.nan if column.sentinel_value is None else column.sentinel_value
+    return numeric, counts
+
+
+def decode_records(records, schema):
+    # A page's raw frame with the schema's numeric columns already parsed, so coerce_frame only has
+    # to fill, round and cast them; their counts are kept in attrs['coercion'] for its report.
+    # from_records is the fastest way here to turn the records into column arrays, and columns
+    # sharing a sentinel are parsed together as one block
+    raw_df = pd.DataFrame.from_records(records)
+    groups = {}
+    for column in schema:
+        if column.dtype not in ('str', 'category') and column.source in raw_df:
+            groups.setdefault((column.sentinel, column.sentinel_value), []).append(column)
+    parsed, counts = {}, {}
+    for columns in groups.values():
+        names = [column.source for column in columns]
+        numeric, block_counts = parse_numeric(raw_df[names].to_numpy(dtype=object).T, columns[0])
+        parsed.update(zip(names, numeric))
+        counts.update(zip(names, block_counts))
+    df = pd.DataFrame({name: parsed.get(name, raw_df[name].to_numpy()) for name in raw_df.columns})
+    df.attrs['coercion'] = counts
+    return df
+
+
+def page_decoder(schema):
+    # decode= for cms_api.fetch_frame and dataset_cache.sync_dataset: the schema's numeric columns are
+    # parsed while each page is turned into columns, before the process function sees them
+    return functools.partial(decode_records, schema=schema)
+
+
+def merge_counts(chunks):
+    # attrs['coercion'] of decoded chunks, summed for the frame they are concatenated into
+    merged = {}
+    for chunk in chunks:
+        for name, counts in chunk.attrs.get('coercion', {}).items():
+            total = merged.setdefault(name, dict.fromkeys(counts, 0))
+            for key, value in counts.items():
+                total[key] += value
+    return merged
+
+
+def coerce_column(raw, column):
+    if column.dtype in ('str', 'category'):
+        values = raw.astype(str).str.strip()
+        return (values.astype('category') if column.dtype == 'category' else values), None
+
+    if pd.api.types.is_float_dtype(raw):
+        # Already parsed by decode_records
+        numeric, counts = raw, None
+    else:
+        numeric, counts = parse_numeric(raw.to_numpy(dtype=object)[np.newaxis], column)
+        numeric, counts = pd.Series(numeric[0], index=raw.index), counts[0]
+    numeric = numeric.fillna(0)
+    if column.decimals is not None:
+        numeric = numeric.round(column.decimals)
+    elif pd.api.types.is_integer_dtype(column.dtype):
+        numeric = numeric.round()
+    return numeric.astype(column.dtype), counts
+
+
+def coerce_frame(raw_df, schema):
+    # Applies the schema in one pass and returns the new frame with a per-column report of how many
+    # values were missing, replaced for a suppression sentinel or unparseable (all filled with 0)
+    with span('schema.coerce', rows_in=len(raw_df), columns=len(schema)):
+        parsed = raw_df.attrs.get('coercion', {})
+        columns, report = {}, {}
+        for column in schema:
+            if column.source not in raw_df:
+                report.setdefault('absent_columns', []).append(column.source)
+                continue
+            columns[column.name], counts = coerce_column(raw_df[column.source], column)
+            counts = counts or parsed.get(column.source)
+            if counts:
+                report[column.name] = counts
+        return pd.DataFrame(columns).reset_index(drop=True), report
+
+
+def log_report(dataset_name, report):
+    totals = {key: sum(counts[key] for name, counts in report.items() if name != 'absent_columns')
+              for key in ('missing', 'suppressed', 'coerced')}
+    logger.info("%s coercion: %s", dataset_name, totals)
+    if report.get('absent_columns'):
+        logger.warning("%s is missing columns: %s", dataset_name, ', '.join(report['absent_columns']))
@@ -0,0 +1,44 @@
+import numpy as np
+
+from instrumentation import traced
+
+# Rows per page of the dashboards' paged tables
+PAGE_SIZE = 50
+
+
+@traced('table.sort_orders')
+def build_sort_orders(df, columns=None):
+    # For every column, the row positions in ascending order and each row's rank in that order.
+    # Built once per dataset version, so sorting the whole table is a slice of 'order' and sorting a
+    # subset of rows (e.g. search matches) only sorts their ranks
+    orders = {}
+    for column in df.columns if columns is None else columns:
+        order = np.argsort(df[column].to_numpy(), kind='stable').astype(np.int32)
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order), dtype=np.int32)
+        orders[column] = {'order': order, 'ranks': ranks}
+    return orders
+
+
+def table_rows(orders, row_count, rows=None, sort_column=None, descending=False):
+    # Row positions of the table in display order. rows limits it to a subset, which keeps its own
+    # order (e.g. search ranking) unless a sort column is given
+    if sort_column is None:
+        return np.arange(row_count) if rows is None else np.asarray(rows)
+    sort_order = orders[sort_column]
+    if rows is None:
+        ordered = sort_order['order']
+    else:
+        rows = np.asarray(rows)
+        ordered = rows[np.argsort(sort_order['ranks'][rows], kind='stable')]
+    return ordered[::-1] if descending else ordered
+
+
+def page_count(row_count, page_size=PAGE_SIZE):
+    return max(-(-row_count // page_size), 1)
+
+
+def page_window(rows, page, page_size=PAGE_SIZE):
+    # The rows of one page (1-based), clamped to the pages that exist
+    page = min(max(page, 1), page_count(len(rows), page_size))
+    return rows[(page - 1) * page_size:page * page_size], page
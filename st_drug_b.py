@@ -1,14 +1,18 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from drugs_b_data_retrieval import fetch_data, process_data
+from dashboard_page import data_version, load_drug_lookup, load_processed_frame, load_sort_orders, run_page
+from instrumentation import start_trace
+from trace_panel import show_trace_panel
+from drug_search import lookup_rows, lookup_trend
+from paged_table import frame_page, show_paged_table
+from figure_cache import show_figure
 
-def create_searchable_dropdown(df):
-    search_options = pd.concat([df['Brand Name'], df['Generic Name']]).unique()
-    search_options.sort()
+# The lookup, sort orders and processed frame come from the dataset registry (see dashboard_page); the
+# table's pages are read from the memory-mapped processed frame
 
+def create_searchable_dropdown(lookup, table, sort_orders):
     selected_option = st.selectbox("Search for a drug by name:", 
-                                   options=search_options,
+                                   options=lookup['options'],
                                    format_func=lambda x: x if pd.notna(x) else "Not Available")
     
     columns_2022 = [
@@ -18,34 +22,35 @@ def create_searchable_dropdown(df):
         'Average Sales Price'
     ]
 
-    if selected_option and selected_option != "Not Available":
-        filtered_df = df[(df['Brand Name'] == selected_option) | (df['Generic Name'] == selected_option)]
-        st.dataframe(filtered_df[columns_2022])
-    else:
-        st.dataframe(df[columns_2022])
+    rows = lookup_rows(lookup, selected_option) if selected_option and selected_option != "Not Available" else None
+    show_paged_table(len(table), frame_page(table), columns_2022, sort_orders, rows, key='drug_table')
 
-def plot_spending_trends(df, selected_drug):
+def spending_trends_figure(lookup, selected_row):
     spending_data = {
-        'Year': ['2018', '2019', '2020', '2021', '2022'],
-        'Average Spending Per Beneficiary': [
-            df.at[selected_drug, 'Average Spending Per Beneficiary 2018'],
-            df.at[selected_drug, 'Average Spending Per Beneficiary 2019'],
-            df.at[selected_drug, 'Average Spending Per Beneficiary 2020'],
-            df.at[selected_drug, 'Average Spending Per Beneficiary 2021'],
-            df.at[selected_drug, 'Average Spending Per Beneficiary 2022'],
-        ]
+        'Year': lookup['tensor']['years'],
+        'Average Spending Per Beneficiary': lookup_trend(lookup, selected_row, 'Average Spending Per Beneficiary'),
     }
 
     # Convert the data to a DataFrame
     spending_df = pd.DataFrame(spending_data)
 
+    # Imported on first chart so the page starts drawing sooner
+    import plotly.express as px
+
     fig = px.line(spending_df, x='Year', y='Average Spending Per Beneficiary',
                   title=f"Spending Trends",
                   markers=True,
                   labels={'Average Spending Per Beneficiary': 'Average Spending ($)', 'Year': 'Year'})
-    st.plotly_chart(fig)
+    return fig
+
+def plot_spending_trends(lookup, selected_row):
+    # Served from the process-wide figure cache when any session has charted this drug before
+    show_figure((data_version('drugs_b'), 'drugs_b/spending', None, 'Average Spending Per Beneficiary',
+                 int(selected_row)),
+                lambda: spending_trends_figure(lookup, selected_row))
 
 def main():
+    run_trace = start_trace()
     st.title("Medicare Part B Drug Spending Dashboard")
     st.markdown("""
                 The Medicare Part B Drug Spending Dashboard allows you to explore drug spending trends for different medications.
@@ -53,17 +58,32 @@ def main():
                 Part B drugs are administered by a healthcare provider and are typically covered under Medicare Part B. 
                 This dataset provides information on the spending, dosage units, claims, and beneficiaries for various drugs in 2022.                
                 """)
-    raw_df = fetch_data()
-    processed_df = process_data(raw_df)
-    create_searchable_dropdown(processed_df)
-        
-    search_options = pd.concat([processed_df['Brand Name'], processed_df['Generic Name']]).unique()
-    selected_option = st.selectbox("Select a drug to view spending trends:", options=search_options,
-                                   format_func=lambda x: x if pd.notna(x) else "Not Available")
-    if selected_option and selected_option != "Not Available":
-        selected_index = processed_df[(processed_df['Brand Name'] == selected_option) | (processed_df['Generic Name'] == selected_option)].index
-    if not selected_index.empty:
-        plot_spending_trends(processed_df, selected_index[0])
+    # The table and the trend chart fill in as their data arrives
+    progress = st.progress(0.0, text="Loading data...")
+    table_slot, trend_slot = st.empty(), st.empty()
+    table_slot.caption("Loading...")
+
+    loads = {'drug lookup': lambda: load_drug_lookup('drugs_b'), 'sort orders': lambda: load_sort_orders('drugs_b'),
+             'drug table': lambda: load_processed_frame('drugs_b')}
+    sections = {'table': ['drug lookup', 'drug table', 'sort orders'], 'trends': ['drug lookup']}
+    slots = {'table': table_slot, 'trends': trend_slot}
+
+    def render_section(section, loaded):
+        lookup = loaded['drug lookup']
+        if section == 'table':
+            with table_slot.container():
+                create_searchable_dropdown(lookup, loaded['drug table'], loaded['sort orders'])
+            return
+        with trend_slot.container():
+            selected_option = st.selectbox("Select a drug to view spending trends:", options=lookup['options'],
+                                           format_func=lambda x: x if pd.notna(x) else "Not Available")
+            if selected_option and selected_option != "Not Available":
+                selected_rows = lookup_rows(lookup, selected_option)
+                if len(selected_rows):
+                    plot_spending_trends(lookup, selected_rows[0])
+
+    run_page(loads, sections, slots, render_section, progress)
+    show_trace_panel(run_trace)
 
 if __name__ == "__main__":
     main() 
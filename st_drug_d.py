@@ -1,17 +1,39 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from drugs_d_data_retrieval import fetch_data, process_data
+from dashboard_page import (data_version, load_drug_lookup, load_processed_frame, load_sort_orders, processed_frame,
+                            run_page, shared)
+import artifacts
+from instrumentation import start_trace
+from trace_panel import show_trace_panel
+from drug_search import build_search_index, lookup_rows, search_index
+from drug_tensor import to_long
+from paged_table import frame_page, show_paged_table
+from drug_analytics import build_drug_analytics, drug_history, top_growth, top_spending
+from figure_cache import show_figure
 
-def create_searchable_table(df):
-    search_query = st.text_input("Search for a drug by brand name or generic name:")
-    if search_query:
-        df_filtered = df[
-            df['Brand Name'].str.contains(search_query, case=False) |
-            df['Generic Name'].str.contains(search_query, case=False)
-        ]
-    else:
-        df_filtered = df
+# The lookup, sort orders, processed frame, search index and analytics come from the dataset registry
+# (see dashboard_page); the table's pages are read from the memory-mapped processed frame
+
+def build_index():
+    index = artifacts.load_pickle('drugs_d', 'search_index')
+    return index if index is not None else build_search_index(processed_frame('drugs_d'))
+
+def load_search_index():
+    return shared('drugs_d', 'search_index', build_index)
+
+def analytics_version():
+    # Part B and Part D analytics depend on both datasets, so they are rebuilt when either changes
+    return f"{data_version('drugs_d')}+{data_version('drugs_b')}"
+
+def build_analytics():
+    return build_drug_analytics({'Part B': load_processed_frame('drugs_b'),
+                                 'Part D': load_processed_frame('drugs_d')})
+
+def load_analytics():
+    return shared('drugs_d', 'analytics', build_analytics, analytics_version())
+
+def create_searchable_table(table, search_query, sort_orders):
+    # Search matches keep their ranking until a sort column is picked
+    matches = search_index(load_search_index(), search_query) if search_query else None
     
     columns_to_display = [
         'Brand Name', 'Generic Name', 'Total Spending 2022', 'Total Beneficiaries 2022', 
@@ -21,40 +43,98 @@ def create_searchable_table(df):
         'CAGR Average Spending Per Dosage Unit 2018-2022'
     ]
     
-    st.dataframe(df_filtered[columns_to_display])
+    show_paged_table(len(table), frame_page(table), columns_to_display, sort_orders, matches, key='drug_table')
+
+def spending_trends_figure(lookup, selected_row, drug_choice):
+    spending_data = to_long(lookup['tensor'], selected_row, ['Average Spending Per Beneficiary'])
 
-def plot_spending_trends(df, drug_choice):
-    drug_data = df[(df['Brand Name'] == drug_choice) | (df['Generic Name'] == drug_choice)]
-    spending_data = pd.DataFrame({
-        'Year': [col.split()[-1] for col in df.columns if 'Average Spending Per Dosage Unit Weighted' in col],
-        'Average Spending Per Beneficiary': drug_data[[col for col in df.columns if 'Average Spending Per Beneficiary' in col]].iloc[0].values
-    })
-    spending_data['Year'] = spending_data['Year'].astype(int)
+    # Create line chart using Plotly, imported on first chart so the page starts drawing sooner
+    import plotly.express as px
 
-    # Create line chart using Plotly
     fig = px.line(spending_data, x='Year',
-                  y=['Average Spending Per Beneficiary'],
+                  y='Value', color='Metric',
                   title=f"Spending Trends for {drug_choice}",
-                  labels={'value': 'Average Spending ($)', 'Year': 'Year'},
+                  labels={'Value': 'Average Spending ($)', 'Year': 'Year'},
                   markers=True)
-    st.plotly_chart(fig)
+    return fig
+
+def plot_spending_trends(lookup, drug_choice):
+    selected_rows = lookup_rows(lookup, drug_choice)
+    if not len(selected_rows):
+        return
+    # Served from the process-wide figure cache when any session has charted this drug before
+    show_figure((data_version('drugs_d'), 'drugs_d/spending', None, 'Average Spending Per Beneficiary',
+                 drug_choice),
+                lambda: spending_trends_figure(lookup, selected_rows[0], drug_choice))
+
+def part_history_figure(history, generic):
+    import plotly.express as px
+
+    return px.line(history.reset_index().melt(id_vars='Year', var_name='Part', value_name='Total Spending'),
+                   x='Year', y='Total Spending', color='Part', markers=True,
+                   title=f"Total Spending for {generic}", labels={'Total Spending': 'Total Spending ($)'})
+
+def show_part_comparison(analytics):
+    st.subheader("Part B and Part D by Generic Drug")
+    years = analytics['years']
+    rankings = {
+        f"Largest total spending {years[-1]}": lambda n, both: top_spending(analytics, years[-1], n, in_all_parts=both),
+        f"Fastest spending growth (CAGR) {years[0]}-{years[-1]}":
+            lambda n, both: top_growth(analytics, years[0], years[-1], n, in_all_parts=both),
+        f"Biggest spending increase {years[-2]}-{years[-1]}":
+            lambda n, both: top_growth(analytics, years[-2], years[-1], n, by='Change', in_all_parts=both),
+        f"Biggest spending decrease {years[-2]}-{years[-1]}":
+            lambda n, both: top_growth(analytics, years[-2], years[-1], n, by='Change', largest=False, in_all_parts=both),
+    }
+    ranking = st.selectbox("Ranking", list(rankings))
+    n = st.slider("Number of drugs", min_value=5, max_value=50, value=10, step=5)
+    both = st.checkbox("Only drugs covered under both parts")
+    st.dataframe(rankings[ranking](n, both), hide_index=True)
+
+    generic = st.selectbox("Compare a generic drug across parts:", sorted(analytics['names']))
+    history = drug_history(analytics, generic)
+    if history is not None:
+        show_figure((analytics_version(), 'drugs_d/part_comparison', None, 'Total Spending', generic),
+                    lambda: part_history_figure(history, generic))
 
 def main():
+    run_trace = start_trace()
     st.title("Medicare Part D Drug Spending Dashboard")
     st.markdown("""
         The Medicare Part D Drug Spending Dashboard allows you to explore drug spending trends for different medications.
 
         Part D drugs are drugs patients administer themselves and are paid through the Medicare Part D subscription program.
     """)
-    raw_df = fetch_data()
-    processed_df = process_data(raw_df)
-    create_searchable_table(processed_df)
+    # The search box is drawn right away; the table and the trend chart fill in as their data arrives
+    search_query = st.text_input("Search for a drug by brand name or generic name:")
+    progress = st.progress(0.0, text="Loading data...")
+    table_slot, trend_slot, comparison_slot = st.empty(), st.empty(), st.empty()
+    table_slot.caption("Loading...")
+
+    loads = {'drug lookup': lambda: load_drug_lookup('drugs_d'), 'sort orders': lambda: load_sort_orders('drugs_d'),
+             'drug table': lambda: load_processed_frame('drugs_d'), 'part b comparison': load_analytics}
+    sections = {'table': ['drug table', 'sort orders'], 'trends': ['drug lookup'], 'comparison': ['part b comparison']}
+    if search_query:
+        loads['search index'] = load_search_index
+        sections['table'].append('search index')
+    slots = {'table': table_slot, 'trends': trend_slot, 'comparison': comparison_slot}
 
-    drug_choices = pd.concat([processed_df['Brand Name'], processed_df['Generic Name']]).unique()
-    drug_choices = st.selectbox("Select a drug to view spending trends:", drug_choices)
+    def render_section(section, loaded):
+        if section == 'table':
+            with table_slot.container():
+                create_searchable_table(loaded['drug table'], search_query, loaded['sort orders'])
+        elif section == 'comparison':
+            with comparison_slot.container():
+                show_part_comparison(loaded['part b comparison'])
+        else:
+            with trend_slot.container():
+                lookup = loaded['drug lookup']
+                drug_choices = st.selectbox("Select a drug to view spending trends:", lookup['options'])
+                if drug_choices:
+                    plot_spending_trends(lookup, drug_choices)
 
-    if drug_choices:
-        plot_spending_trends(processed_df, drug_choices)
+    run_page(loads, sections, slots, render_section, progress)
+    show_trace_panel(run_trace)
 
 if __name__ == "__main__":
     main()  
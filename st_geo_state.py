@@ -1,155 +1,177 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-from geo_data_retrieval import fetch_data, process_data, calculate_pct_diff, get_us_state_geojson
+from geo_data_retrieval import load_data, load_comparison_data
+from dashboard_page import data_version, run_page, shared
+from geo_cube import build_geo_cube, geo_names, map_slice
+from geo_trends import MEASURES, build_geo_trends, trend_ranking, trend_slice
+from geo_views import (create_cost_breakdown_chart, create_map_chart, create_multi_year_cost_chart,
+                       create_state_details_table)
+from geometry import DETAIL_LEVELS, get_us_county_geojson, get_us_state_geojson
+import artifacts
+from figure_cache import show_figure
+from instrumentation import start_trace
+from trace_panel import show_trace_panel
+
+# Frames and cubes come from the artifacts when there are any and live in the dataset registry;
+# see dashboard_page
+
+def build_dashboard_data():
+    df = artifacts.load_table('geo', 'dashboard')
+    return df if df is not None else load_data()
+
+def build_state_data():
+    df = artifacts.load_table('geo', 'state')
+    return df if df is not None else load_comparison_data('State')
+
+def build_county_data():
+    county_df = artifacts.load_table('geo', 'county')
+    if county_df is None:
+        county_df = load_comparison_data('County')
+        # County geometries are keyed by 5-digit FIPS code
+        county_df['geo_code'] = county_df['geo_code'].str.zfill(5)
+    return county_df
+
+def build_cube(geo_level):
+    # Views slice the cube instead of filtering the frame on each widget change
+    cube = artifacts.load_cube('geo', f'{geo_level.lower()}_cube')
+    if cube is None:
+        if geo_level == 'County':
+            cube = build_geo_cube(load_county_data(), 'geo_code')
+        else:
+            cube = build_geo_cube(load_state_data(), 'geo_desc')
+    return cube
 
 def load_geo_data():
-    raw_df = fetch_data()
-    processed_data = process_data(raw_df)
-    return processed_data
+    return shared('geo', 'dashboard', build_dashboard_data)
 
+def load_state_data():
+    return shared('geo', 'state', build_state_data)
+
+def load_county_data():
+    return shared('geo', 'county', build_county_data)
+
+def load_geo_cube(geo_level):
+    return shared('geo', f'{geo_level.lower()}_cube', lambda: build_cube(geo_level))
+
+def load_geo_trends(geo_level):
+    # Growth, rank and national gap measures for every geography, computed once per data version
+    return shared('geo', f'{geo_level.lower()}_trends', lambda: build_geo_trends(load_geo_cube(geo_level)))
+
+@st.cache_resource(show_spinner=False)
+def load_geojson(name, version):
+    geojson = artifacts.load_json('geometry', name)
+    if geojson is not None:
+        return geojson
+    if name == 'us_states':
+        return get_us_state_geojson()
+    return get_us_county_geojson(name.rsplit('_', 1)[1])
+
+def render_state_tables(state_cube, selected_year):
+    states = geo_names(state_cube, 'State')
+    selected_state = st.selectbox("Select State", sorted(states), key='selected_state')
+
+    comparison_table = create_cost_breakdown_chart(state_cube, selected_year, selected_state)
+    st.table(comparison_table)
+
+    # Display the table in the Streamlit dashboard.
+    st.markdown(f"Detailed Information for {selected_state} ({selected_year})")
+    st.table(create_state_details_table(state_cube, selected_year, selected_state))
+
+    if selected_state:
+        show_figure((data_version('geo'), 'geo/multi_year', None, None, selected_state),
+                    lambda: create_multi_year_cost_chart(state_cube, selected_state))
+
+def render_trend_ranking(state_cube, state_trends, selected_cost):
+    st.subheader(f"State Trends: {selected_cost}")
+    st.dataframe(trend_ranking(state_cube, state_trends, selected_cost, 'State').round(2), hide_index=True)
+
+run_trace = start_trace()
+# Header, sidebar and placeholders are drawn before any data is loaded; every load then starts at
+# once in the background and each section is filled in as soon as the data it needs arrives
 st.title("Medicare Geographic Variation Dashboard")
 st.markdown("""
 This dashboard displays Medicare data for the years 2017-2021.
 The data includes per capita costs for various healthcare categories and additional beneficiary information.
 The data is sourced from the Centers for Medicare & Medicaid Services (CMS).
 """)
-dashboard_df = load_geo_data()
-st.write("Preview of the dataset:")
-st.dataframe(dashboard_df.head())
-
-state_df = calculate_pct_diff(dashboard_df)
-
-us_state_url = "https://raw.githubusercontent.com/FrankieHong/IHI/main/data/us_states.geojson"
-us_state_geojson = get_us_state_geojson(us_state_url)
-
-selected_year = st.sidebar.selectbox("Select Year", state_df['year'].unique())
-per_capita_costs = [col for col in state_df.columns if 'per_capita' in col and '_national' not in col]
-selected_cost = st.sidebar.selectbox("Select Cost Metric", per_capita_costs)
-
-yearly_state_data = state_df[(state_df['year'] == selected_year) & (state_df['geo_level'] == 'State')]
-
-# Choropleth map for the selected year and cost metric
-fig = px.choropleth(
-    yearly_state_data,
-    geojson=us_state_geojson,
-    locations='geo_desc',
-    featureidkey='properties.STUSPS',
-    color=selected_cost,
-    scope='usa',
-    hover_data={
-        'geo_desc': False,
-        selected_cost: ':.2f'
-    },
-    hover_name='geo_desc',
-    title=f"{selected_cost} cost by State in {selected_year}",
-    color_continuous_scale=px.colors.sequential.Sunset
-)
-
-fig.update_layout(width=800, height=600,
-                  legend_title_text='Cost per Capita ($)',
-                  legend=dict(
-                      orientation='h',
-                      yanchor='bottom',
-                      y=-0.5,
-                      xanchor='center',
-                      x=0.5
-                  )
-                )
-st.plotly_chart(fig)
-
-def create_cost_breakdown_chart(state_df,selected_year,selected_state):
-    year_df = state_df[state_df['year'] == selected_year]
-    national_data = year_df[year_df['geo_level'] == 'National'].iloc[0]
-    state_data = year_df[year_df['geo_desc'] == selected_state].iloc[0]
-
-    chart_df = pd.DataFrame({
-        'Cost':['Total','Inpatient','Ambulance','Post Acute Care','Durable Medical Equipment','Part B Drugs','Physician OPD','Hospice'],
-        'State':[
-            state_data['total_costs_per_capita'],
-            state_data['inpatient_per_capita'],
-            state_data['ambulance_per_capita'],
-            state_data['post_acute_care_per_capita'],
-            state_data['durable_medical_equipment_per_capita'],
-            state_data['part_b_drug_per_capita'],
-            state_data['physician_opd_per_capita'],
-            state_data['hospice_per_capita']
-        ],
-        'Nation':[
-            national_data['total_costs_per_capita'],
-            national_data['inpatient_per_capita'],
-            national_data['ambulance_per_capita'],
-            national_data['post_acute_care_per_capita'],
-            national_data['durable_medical_equipment_per_capita'],
-            national_data['part_b_drug_per_capita'],
-            national_data['physician_opd_per_capita'],
-            national_data['hospice_per_capita']
-        ],
-        '% Diff to Nation':[
-            state_data['total_costs_per_capita_pct_diff_to_national'],
-            state_data['inpatient_per_capita_pct_diff_to_national'],
-            state_data['ambulance_per_capita_pct_diff_to_national'],
-            state_data['post_acute_care_per_capita_pct_diff_to_national'],
-            state_data['durable_medical_equipment_per_capita_pct_diff_to_national'],
-            state_data['part_b_drug_per_capita_pct_diff_to_national'],
-            state_data['physician_opd_per_capita_pct_diff_to_national'],
-            state_data['hospice_per_capita_pct_diff_to_national']
-        ]
-    })
-    return chart_df.round(2)
-
-states = state_df[state_df['geo_level'] == 'State']['geo_desc'].unique()
-selected_state = st.selectbox("Select State", sorted(states))
-
-comparison_table = create_cost_breakdown_chart(state_df,selected_year,selected_state)
-st.table(comparison_table)
-
-state_info = state_df[(state_df['year'] == selected_year) & (state_df['geo_desc'] == selected_state)]
-state_details = {
-    'Beneficiary Count': state_info['beneficiary_count'].values[0],
-    '% Eligible for Medicaid': state_info['percent_eligible_medicaid'].values[0]*100,
-    'Hospital Readmission Rate (%)': state_info['hospital_readmission_rate'].values[0]*100,
-    'ED Visits per 1000 Beneficiaries': state_info['ed_visits_per_1000_beneficiaries'].values[0]
+year_slot, cost_slot = st.sidebar.empty(), st.sidebar.empty()
+map_level = st.sidebar.radio("Map Level", ['State', 'County'])
+# What the map colors by: the selected cost itself or one of its trend measures
+map_views = {'Cost': None, 'Year-over-year growth': 'yoy', 'Growth over all years (CAGR)': 'cagr',
+             'Difference to national': 'gap'}
+map_measure = map_views[st.sidebar.radio("Map Shows", list(map_views))]
+if map_level == 'County':
+    map_detail = st.sidebar.selectbox("Map Detail", list(DETAIL_LEVELS), index=1)
+    map_geojson_name = f'us_counties_{map_detail}'
+    map_loads = {'county data': lambda: load_geo_cube('County'),
+                 'county boundaries': lambda: load_geojson(map_geojson_name, artifacts.current_version())}
+    if map_measure:
+        map_loads['county trends'] = lambda: load_geo_trends('County')
+    map_locations, map_featureidkey = 'geo_code', 'id'
+else:
+    map_geojson_name = 'us_states'
+    map_loads = {'state boundaries': lambda: load_geojson(map_geojson_name, artifacts.current_version()),
+                 'state trends': lambda: load_geo_trends('State')}
+    map_locations, map_featureidkey = 'geo_desc', 'properties.STUSPS'
+
+progress = st.progress(0.0, text="Loading data...")
+preview_slot, map_slot, tables_slot = st.empty(), st.empty(), st.empty()
+for slot in (preview_slot, map_slot, tables_slot):
+    slot.caption("Loading...")
+
+loads = {'dataset preview': load_geo_data, 'state data': lambda: load_geo_cube('State'),
+         'state trends': lambda: load_geo_trends('State'), **map_loads}
+# Sections are drawn in this order as soon as the loads they need are in
+sections = {
+    'preview': ['dataset preview'],
+    'selectors': ['state data'],
+    'map': ['state data', *map_loads],
+    'tables': ['state data', 'state trends'],
 }
-state_details_df = pd.DataFrame(state_details.items(), columns=['Metric', 'Value'])
-state_details_df.set_index('Metric', inplace=True)
-state_details_df = state_details_df.round(2)
-
-# Convert numerical columns to strings to enforce the two decimal place format in Streamlit's table display.
-state_details_df_str = state_details_df.applymap(lambda x: f"{x:.2f}" if isinstance(x, (int, float)) else x)
-
-# Display the table in the Streamlit dashboard.
-st.markdown(f"Detailed Information for {selected_state} ({selected_year})")
-st.table(state_details_df_str)
-
-def create_multi_year_cost_chart(state_df, selected_state):
-    state_data = state_df[state_df['geo_desc'] == selected_state]
-    plot_data = state_data.melt(id_vars=['year'], value_vars=[
-        'total_costs_per_capita', 'inpatient_per_capita', 'ambulance_per_capita',
-        'post_acute_care_per_capita', 'durable_medical_equipment_per_capita',
-        'part_b_drug_per_capita', 'physician_opd_per_capita', 'hospice_per_capita'
-    ], var_name='Cost Type', value_name='Cost Per Capita')
-
-    fig = px.line(
-        plot_data,
-        x='year',
-        y='Cost Per Capita',
-        color='Cost Type',
-        title=f"Annual Cost Breakdown Per Capita for {selected_state}",
-        labels={'Cost Per Capita': 'Cost Per Capita ($)', 'year': 'Year'},
-        markers=True
-    )
-    fig.update_layout(
-        xaxis_title='Year',
-        yaxis_title='Cost Per Capita ($)',
-        legend_title='Cost Type',
-        legend=dict(orientation='h', yanchor='bottom', y=-0.5, xanchor='center', x=0.5)
-    )
-    return fig
-
-if selected_state:
-    st.plotly_chart(create_multi_year_cost_chart(state_df, selected_state))
-
-
-
-
+slots = {'preview': preview_slot, 'selectors': year_slot, 'map': map_slot, 'tables': tables_slot}
+selection = {}
+
+def render_section(section, loaded):
+    if section == 'preview':
+        with preview_slot.container():
+            st.write("Preview of the dataset:")
+            st.dataframe(loaded['dataset preview'].head())
+    elif section == 'selectors':
+        state_cube = loaded['state data']
+        per_capita_costs = [col for col in state_cube['metrics'] if 'per_capita' in col and '_national' not in col]
+        # The latest year by default: the first year has no year-over-year growth to map
+        selection['year'] = year_slot.selectbox("Select Year", state_cube['years'], index=len(state_cube['years']) - 1,
+                                                key='selected_year')
+        selection['cost'] = cost_slot.selectbox("Select Cost Metric", per_capita_costs, key='selected_cost')
+    elif section == 'map':
+        map_cube = loaded['county data'] if map_level == 'County' else loaded['state data']
+        map_geojson = loaded['county boundaries'] if map_level == 'County' else loaded['state boundaries']
+        # Maps are cached per selection with the boundaries serialized once, however often they are drawn
+        # CAGR maps cover every year, so all years share one
+        map_year = None if map_measure == 'cagr' else int(selection['year'])
+        map_key = (data_version('geo'), f'geo/map/{map_level}/{map_measure}', map_year, selection['cost'],
+                   map_geojson_name)
+        geojson_key = (map_geojson_name, artifacts.current_version())
+        if map_measure is None:
+            show_figure(map_key, lambda: create_map_chart(
+                map_slice(map_cube, selection['year'], selection['cost'], map_level), map_geojson, map_locations,
+                map_featureidkey, selection['cost'], map_level, selection['year']),
+                map_geojson, geojson_key, container=map_slot)
+            return
+        map_trends = loaded['county trends'] if map_level == 'County' else loaded['state trends']
+        trend_map_data = trend_slice(map_cube, map_trends, map_measure, selection['cost'], map_level, selection['year'])
+        if trend_map_data.empty:
+            map_slot.info(f"No {MEASURES[map_measure].lower()} for {selection['year']}; pick a later year.")
+            return
+        period = (f"{map_cube['years'][0]}-{map_cube['years'][-1]}" if map_measure == 'cagr'
+                  else str(selection['year']))
+        show_figure(map_key, lambda: create_map_chart(
+            trend_map_data, map_geojson, map_locations, map_featureidkey, MEASURES[map_measure], map_level,
+            selection['year'], title=f"{selection['cost']}: {MEASURES[map_measure]} by {map_level}, {period}"),
+            map_geojson, geojson_key, container=map_slot)
+    elif section == 'tables':
+        with tables_slot.container():
+            render_state_tables(loaded['state data'], selection['year'])
+            render_trend_ranking(loaded['state data'], loaded['state trends'], selection['cost'])
+
+run_page(loads, sections, slots, render_section, progress)
+show_trace_panel(run_trace)
@@ -0,0 +1,107 @@
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import cms_api
+import dataset_cache
+from cms_stub_server import start_server
+
+DATASET_ID = "stub-dataset"
+RECORDS = [{"YEAR": str(2017 + i % 5), "STATE": ["CA", "NY", "TX"][i % 3], "VALUE": str(i * 1.5)} for i in range(23)]
+
+
+def write_fixture(directory, records):
+    path = os.path.join(directory, f"{DATASET_ID}.json")
+    with open(path, "w") as f:
+        json.dump(records, f)
+    return path
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    # The stub server on a small fixture, with cms_api pointed at it instead of data.cms.gov
+    path = write_fixture(tmp_path, RECORDS)
+    server, base_url = start_server(str(tmp_path))
+    monkeypatch.setattr(cms_api, "BASE_URL", base_url)
+    monkeypatch.setattr(cms_api, "FIXTURE_DIR", None)
+    yield server, path
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("filters, columns", [
+    ([("STATE", "=", "CA")], None),
+    ([("YEAR", "IN", ["2018", "2020"])], None),
+    ([("STATE", "=", "NY"), ("YEAR", "IN", ["2017", "2019", "2021"])], ["STATE", "VALUE"]),
+    (None, ["YEAR"]),
+])
+def test_queries_match_filter_records(stub, filters, columns):
+    expected = cms_api.filter_records(RECORDS, filters, columns)
+    query = cms_api.build_query(filters, columns)
+
+    assert cms_api.count_rows(DATASET_ID, query) == len(expected)
+    assert list(cms_api.page_offsets(DATASET_ID, query, 4)) == list(range(0, len(expected), 4))
+    pages = list(cms_api.iter_pages(DATASET_ID, filters, columns, size=4, max_workers=2))
+    assert [len(page) for page in pages] == [len(expected[offset:offset + 4]) for offset in range(0, len(expected), 4)]
+    assert [record for page in pages for record in page] == expected
+
+
+def test_sync_reprocesses_only_changed_pages(stub, tmp_path, monkeypatch):
+    server, path = stub
+    monkeypatch.setattr(dataset_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dataset_cache, "iter_page_updates", functools.partial(cms_api.iter_page_updates, size=5))
+    processed = []
+
+    def process(chunk):
+        processed.append(chunk["VALUE"].tolist())
+        return chunk
+
+    df = dataset_cache.sync_dataset(DATASET_ID, process, ttl=0)
+    assert len(processed) == 5
+    pd.testing.assert_frame_equal(df, pd.DataFrame.from_records(RECORDS))
+
+    # Same Last-Modified: the cached frame is kept without fetching any page
+    processed.clear()
+    df = dataset_cache.sync_dataset(DATASET_ID, process, ttl=0)
+    assert processed == []
+    pd.testing.assert_frame_equal(df, pd.DataFrame.from_records(RECORDS))
+
+    # A new revision touching one row of the third page: the other pages come back 304
+    records = [dict(record) for record in RECORDS]
+    records[12]["VALUE"] = "999.0"
+    write_fixture(tmp_path, records)
+    modified = os.path.getmtime(path) + 10
+    os.utime(path, (modified, modified))
+    server.RequestHandlerClass.datasets.clear()
+
+    processed.clear()
+    df = dataset_cache.sync_dataset(DATASET_ID, process, ttl=0)
+    assert processed == [[record["VALUE"] for record in records[10:15]]]
+    pd.testing.assert_frame_equal(df, pd.DataFrame.from_records(records))
+
+
+def test_fetch_in_order_fails_fast():
+    # The third page fails while the first two are still loading; the error is raised without waiting
+    # for them and no later page is requested
+    started = []
+    release = threading.Event()
+
+    def fetch(offset):
+        started.append(offset)
+        if offset == 2:
+            raise cms_api.FetchError("page 2 failed")
+        release.wait(5)
+        return offset
+
+    begin = time.perf_counter()
+    with pytest.raises(cms_api.FetchError, match="page 2 failed"):
+        list(cms_api.fetch_in_order(fetch, range(20), max_workers=3))
+    elapsed = time.perf_counter() - begin
+    release.set()
+    assert elapsed < 1
+    assert sorted(started) == [0, 1, 2]
@@ -0,0 +1,13 @@
+import benchmark
+
+
+def test_headless_modules_stay_within_import_budget():
+    # Each module must import within benchmark.IMPORT_ALLOWANCE of pandas, without Streamlit,
+    # Plotly or requests; see benchmark.py --imports for the per-module table
+    assert benchmark.check_imports(repeat=3) == []
+
+
+def test_import_time_reports_ui_packages():
+    seconds, loaded = benchmark.import_time("paged_table")
+    assert seconds > 0
+    assert "streamlit" in loaded
@@ -0,0 +1,21 @@
+import pandas as pd
+import streamlit as st
+
+import instrumentation
+from figure_cache import FIGURES
+
+
+def show_trace_panel(trace):
+    # Sidebar breakdown of the spans of this script run's trace (see instrumentation.start_trace);
+    # only drawn with IHI_TRACE on
+    if not instrumentation.ENABLED:
+        return
+    spans = instrumentation.recent_spans(trace=trace)
+    with st.sidebar.expander("Debug: stage timings"):
+        if not spans:
+            st.caption("No spans recorded in this run.")
+            return
+        st.dataframe(pd.DataFrame(instrumentation.summarize(spans)).round(1), hide_index=True)
+        st.dataframe(pd.DataFrame(spans).drop(columns=["started_at"]), hide_index=True)
+        st.caption("Figure cache (all sessions)")
+        st.dataframe(pd.DataFrame([FIGURES.stats()]), hide_index=True)